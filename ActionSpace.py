@@ -0,0 +1,73 @@
+"""
+The actions of a player, in the layout of the mask and the model output:
+for every face to every build pile, so first face 1 to build 0, then face 1 to build 1 etc.
+for every face to every discard pile, so first face 1 to discard 0, then face 1 to discard 1 etc.
+from every discard pile to every build pile, so discard 0 to build 0, then discard 0 to build 1 etc.
+from the stock pile to every build pile.
+An action is decoded by looking it up in the tables below, which also work on arrays of actions.
+"""
+import numpy as np
+
+from Card import NUM_FACES
+
+NUM_PILES = 4
+
+# Offsets of the parts of the layout
+HAND_TO_BUILD = 0
+HAND_TO_DISCARD = NUM_FACES * NUM_PILES
+DISCARD_TO_BUILD = HAND_TO_DISCARD + NUM_FACES * NUM_PILES
+STOCK_TO_BUILD = DISCARD_TO_BUILD + NUM_PILES * NUM_PILES
+NUM_ACTIONS = STOCK_TO_BUILD + NUM_PILES
+
+# Kinds of actions, in the order of their parts of the layout
+KIND_HAND_TO_BUILD = 0
+KIND_HAND_TO_DISCARD = 1
+KIND_DISCARD_TO_BUILD = 2
+KIND_STOCK_TO_BUILD = 3
+
+# (kind, face, source, target) of every action:
+# face: The face played from the hand, 0 if the card comes from a discard or the stock pile
+# source: The discard pile played from, -1 if the card does not come from a discard pile
+# target: The build pile played on, or the discard pile for KIND_HAND_TO_DISCARD
+DECODED = ([(KIND_HAND_TO_BUILD, face, -1, build_index)
+            for face in range(1, NUM_FACES + 1) for build_index in range(NUM_PILES)]
+           + [(KIND_HAND_TO_DISCARD, face, -1, discard_index)
+              for face in range(1, NUM_FACES + 1) for discard_index in range(NUM_PILES)]
+           + [(KIND_DISCARD_TO_BUILD, 0, discard_index, build_index)
+              for discard_index in range(NUM_PILES) for build_index in range(NUM_PILES)]
+           + [(KIND_STOCK_TO_BUILD, 0, -1, build_index) for build_index in range(NUM_PILES)])
+ENCODED = {decoded: action for action, decoded in enumerate(DECODED)}
+
+# The columns of DECODED, to decode arrays of actions at once
+KINDS, FACES, SOURCES, TARGETS = (np.array(column, dtype=np.int64) for column in zip(*DECODED))
+ENDS_TURN = KINDS == KIND_HAND_TO_DISCARD
+
+
+def encode(kind, face=0, source=-1, target=0):
+    return ENCODED[kind, face, source, target]
+
+
+def legal_actions(mask):
+    """
+    Indices of the legal actions of a mask, usually a handful instead of NUM_ACTIONS entries
+    """
+    return np.flatnonzero(mask)
+
+
+def best_legal_action(output, legal):
+    """
+    Legal action with the highest value in output, legal as returned by legal_actions
+    """
+    return int(legal[output[legal].argmax()])
+
+
+def sample_legal_actions(masks, rng):
+    """
+    A uniformly random legal action per row of masks, 0 for a row without legal actions.
+    Only the legal actions are looked at after the nonzero pass over masks.
+    """
+    rows, actions = np.nonzero(masks)
+    counts = np.bincount(rows, minlength=len(masks))
+    starts = np.cumsum(counts) - counts
+    picks = starts + (rng.random(len(masks)) * counts).astype(np.int64)
+    return np.where(counts > 0, actions[np.minimum(picks, len(actions) - 1)], 0)
@@ -0,0 +1,119 @@
+import queue
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+import ComputerPlayer as CP
+from VecSkipBoEnv import TransitionTracker, VecSkipBoEnv
+
+QUEUE_SIZE = 64  # Messages waiting for the learner before the actors block
+QUEUE_TIMEOUT = 0.1  # Seconds
+SHUTDOWN_TIMEOUT = 5  # Seconds
+
+
+def run_actor(seed, shared_net, dims, version, steps_done, num_stock_cards, messages, stop_event, num_envs,
+              opponent_input, reward_weights, weight_refresh_interval):
+    """
+    Main loop of an actor process. Plays num_envs games in a VecSkipBoEnv with a local copy of the shared policy net,
+    and sends (transitions, finished games, won games) to the learner after every step.
+    """
+    torch.set_num_threads(1)
+    model = CP.NeuralNetwork(*dims)
+    model.eval()
+    local_version = -1
+    env = VecSkipBoEnv(num_envs, num_stock_cards=num_stock_cards.value, opponent_input=opponent_input,
+                       reward_weights=reward_weights, seed=seed)
+    tracker = TransitionTracker(num_envs, env.dim_in)
+    obs, mask = env.reset()
+    step = 0
+    while not stop_event.is_set():
+        if step % weight_refresh_interval == 0 and version.value != local_version:
+            with version.get_lock():
+                model.load_state_dict(shared_net.state_dict())
+                local_version = version.value
+        env.set_num_stock_cards(num_stock_cards.value)
+
+        transitions = [tracker.before_step(obs, mask, env.current)]
+        actions = CP.select_actions(model, torch.from_numpy(obs), torch.from_numpy(mask),
+                                    CP.epsilon_threshold(steps_done.value)).numpy()
+        next_obs, next_mask, rewards, dones, info = env.step(actions)
+        transitions.append(tracker.after_step(obs, actions, rewards, dones, info))
+        with steps_done.get_lock():
+            steps_done.value += num_envs
+
+        message = ([batch for batch in transitions if batch is not None], int(dones.sum()),
+                   int((info["winner"][dones] >= 0).sum()))
+        while not stop_event.is_set():
+            try:
+                messages.put(message, timeout=QUEUE_TIMEOUT)
+                break
+            except queue.Full:
+                pass
+        obs, mask = next_obs, next_mask
+        step += 1
+    # Do not wait for the learner to read what is still buffered, it stopped reading
+    messages.cancel_join_thread()
+
+
+class ActorPool:
+    """
+    Worker processes that play training games for a learner in the main process.
+    The policy weights are shared with the actors through a network in shared memory and a version number: the
+    learner publishes new weights, an actor reloads them when it sees a newer version.
+    """
+
+    def __init__(self, policy_net, opponent_input, reward_weights, num_actors, envs_per_actor,
+                 weight_refresh_interval):
+        context = mp.get_context("spawn")
+        first_layer = policy_net.linear_relu_stack[0]
+        self.dims = (first_layer.in_features, policy_net.output_layer.out_features,
+                     len(policy_net.linear_relu_stack) // 2, first_layer.out_features)
+        self.shared_net = CP.NeuralNetwork(*self.dims)
+        self.shared_net.load_state_dict(policy_net.state_dict())
+        self.shared_net.share_memory()
+        self.version = context.Value('q', 0)
+        self.steps_done = context.Value('q', 0)
+        self.num_stock_cards = context.Value('i', 1)
+        self.messages = context.Queue(maxsize=QUEUE_SIZE)
+        self.stop_event = context.Event()
+        # Seeded from the global NumPy generator, which the Trainer checkpoints, so resumed runs play the same games
+        seeds = np.random.SeedSequence(np.random.randint(2**63, dtype=np.int64)).spawn(num_actors)
+        self.processes = [
+            context.Process(target=run_actor, daemon=True,
+                            args=(seeds[i], self.shared_net, self.dims, self.version, self.steps_done,
+                                  self.num_stock_cards, self.messages, self.stop_event, envs_per_actor,
+                                  opponent_input, reward_weights, weight_refresh_interval))
+            for i in range(num_actors)]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def publish(self, policy_net):
+        with self.version.get_lock():
+            with torch.no_grad():
+                for shared, parameter in zip(self.shared_net.parameters(), policy_net.parameters()):
+                    shared.copy_(parameter)
+            self.version.value += 1
+
+    def get(self):
+        """
+        Returns the next message of an actor, or None if there was none within QUEUE_TIMEOUT seconds
+        """
+        try:
+            return self.messages.get(timeout=QUEUE_TIMEOUT)
+        except queue.Empty:
+            if not any(process.is_alive() for process in self.processes):
+                raise RuntimeError("All actor processes stopped")
+            return None
+
+    def close(self):
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.messages.close()
+        self.messages.cancel_join_thread()
@@ -0,0 +1,257 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+import torch
+
+import ComputerPlayer as CP
+import OpponentComputerPlayer as OCP
+import Trainer
+from Game import Game
+from RandomComputerPlayer import RandomComputerPlayer
+from RewardEngine import WIN_ONLY
+
+BENCHMARK_DIR = "BenchmarkResults"
+PLAYER_TYPES = {
+    "RandomComputerPlayer": RandomComputerPlayer,
+    "ComputerPlayer": CP.ComputerPlayer,
+    "OpponentComputerPlayer": OCP.OpponentComputerPlayer,
+}
+STOCK_SIZES = [1, 5, 10, 20, 30]
+REPLAY_CAPACITIES = [1_000, 10_000, 100_000]
+NUM_GAMES = 20
+# Untrained players can keep cards going round through the build piles forever, so games are stopped after this many
+MAX_DECISIONS = 10_000
+OPTIMIZE_STEPS = 50
+TARGET_UPDATES = 200
+SEED = 0
+REPEATS = 5  # Runs of every benchmark, the median rate is reported
+REGRESSION_THRESHOLD = 0.1  # Fraction a rate may drop below the baseline before it counts as a regression
+
+
+def make_game(player_type, num_stock_cards):
+    device = torch.device("cpu")
+    if player_type == OCP.OpponentComputerPlayer:
+        model = CP.NeuralNetwork(OCP.DIM_IN, OCP.DIM_OUT, OCP.HIDDEN_COUNT, OCP.DIM_HIDDEN)
+    else:
+        model = CP.NeuralNetwork(CP.DIM_IN, CP.DIM_OUT, CP.HIDDEN_COUNT, CP.DIM_HIDDEN)
+    model.eval()
+    return Game(num_human_players=0, num_computer_players=2, model=[model, model], names=["", ""],
+                computer_type=[player_type, player_type],
+                reward_strategy=[WIN_ONLY, WIN_ONLY], device=device,
+                num_stock_cards=num_stock_cards)
+
+
+def play_game(game, timings=None):
+    """
+    Plays a game like ComputerPlayer.play, stopping it after MAX_DECISIONS decisions. Returns the number of decisions.
+    timings: If given, the seconds spent in every step of a decision are added to it. select_action is then timed with
+             a second call on the state the action is played from.
+    """
+    decisions = 0
+    while game.is_game_running and decisions < MAX_DECISIONS:
+        player = game.players[game.current_player_index]
+        player.start_turn()
+        while not player.end_turn and game.is_game_running and decisions < MAX_DECISIONS:
+            decisions += 1
+            if timings is None:
+                player.compute_mask()
+                player.compute_model_input()
+            else:
+                start = time.perf_counter()
+                player.compute_mask()
+                mask_done = time.perf_counter()
+                player.compute_model_input()
+                input_done = time.perf_counter()
+                player.select_action(training=False, verbose=False, steps_done=0)
+                timings["compute_mask"] += mask_done - start
+                timings["compute_model_input"] += input_done - mask_done
+                timings["select_action"] += time.perf_counter() - input_done
+            player.select_and_do_action(training=False, steps_done=0)
+        game.next_turn()
+    return decisions
+
+
+def benchmark_games(player_type, num_stock_cards, num_games):
+    """
+    Games and decisions per second of complete games between two players of player_type
+    """
+    decisions = 0
+    elapsed = 0.0
+    for _ in range(num_games):
+        game = make_game(player_type, num_stock_cards)
+        start = time.perf_counter()
+        decisions += play_game(game)
+        elapsed += time.perf_counter() - start
+    return {"games_per_sec": num_games / elapsed, "decisions_per_sec": decisions / elapsed}
+
+
+def benchmark_decisions(player_type, num_stock_cards, num_games):
+    """
+    Calls per second of the steps of a decision, timed separately during complete games
+    """
+    timings = {"compute_mask": 0.0, "compute_model_input": 0.0, "select_action": 0.0}
+    decisions = sum(play_game(make_game(player_type, num_stock_cards), timings) for _ in range(num_games))
+    return {f"{name}_per_sec": decisions / elapsed for name, elapsed in timings.items()}
+
+
+def make_trainer(memory_capacity, prioritized):
+    """
+    Trainer with a replay memory filled with random experiences
+    """
+    trainer = Trainer.Trainer(CP.ComputerPlayer, WIN_ONLY, torch.device("cpu"), memory_capacity=memory_capacity,
+                              prioritized=prioritized)
+    trainer.memory.add_batch(torch.rand(memory_capacity, CP.DIM_IN),
+                             torch.randint(CP.DIM_OUT, (memory_capacity,)),
+                             torch.randn(memory_capacity),
+                             torch.rand(memory_capacity, CP.DIM_IN),
+                             (torch.rand(memory_capacity, CP.DIM_OUT) < 0.2).float(),
+                             torch.rand(memory_capacity) < 0.01)
+    return trainer
+
+
+def benchmark_optimize_model(memory_capacity, prioritized, steps):
+    trainer = make_trainer(memory_capacity, prioritized)
+    trainer.optimize_model()  # Warm up
+    start = time.perf_counter()
+    for _ in range(steps):
+        trainer.optimize_model()
+    return {"steps_per_sec": steps / (time.perf_counter() - start)}
+
+
+def benchmark_target_update(target_update, updates):
+    trainer = Trainer.Trainer(CP.ComputerPlayer, WIN_ONLY, torch.device("cpu"), memory_capacity=Trainer.BATCH_SIZE,
+                              target_update=target_update)
+    start = time.perf_counter()
+    for _ in range(updates):
+        trainer.update_target_net()
+    return {"updates_per_sec": updates / (time.perf_counter() - start)}
+
+
+def repeat(benchmark, repeats, *args):
+    """
+    Runs a benchmark repeats times from the same seeds. Returns the rates of every run, as a dictionary of rate to the
+    list of its values.
+    """
+    runs = []
+    for _ in range(repeats):
+        random.seed(SEED)
+        torch.manual_seed(SEED)
+        runs.append(benchmark(*args))
+    return {rate: [run[rate] for run in runs] for rate in runs[0]}
+
+
+def run_benchmarks(stock_sizes=STOCK_SIZES, replay_capacities=REPLAY_CAPACITIES, num_games=NUM_GAMES,
+                   optimize_steps=OPTIMIZE_STEPS, target_updates=TARGET_UPDATES, repeats=REPEATS):
+    """
+    Returns (results, samples): the median rates as a dictionary of benchmark name to its rates, every rate is higher is
+    better, and the rates of all repeats runs in the same layout with a list per rate
+    """
+    samples = {}
+    for name, player_type in PLAYER_TYPES.items():
+        for num_stock_cards in stock_sizes:
+            print(f"Games of {name} with {num_stock_cards} stock cards")
+            samples[f"game/{name}/stock_{num_stock_cards}"] = repeat(benchmark_games, repeats, player_type,
+                                                                     num_stock_cards, num_games)
+            samples[f"decision/{name}/stock_{num_stock_cards}"] = repeat(benchmark_decisions, repeats, player_type,
+                                                                         num_stock_cards, num_games)
+    for memory_capacity in replay_capacities:
+        for prioritized in [False, True]:
+            print(f"optimize_model with a {'prioritized ' if prioritized else ''}replay memory of {memory_capacity}")
+            replay = "prioritized" if prioritized else "uniform"
+            samples[f"optimize_model/{replay}/capacity_{memory_capacity}"] = repeat(
+                benchmark_optimize_model, repeats, memory_capacity, prioritized, optimize_steps)
+    for target_update in Trainer.TARGET_UPDATES:
+        print(f"{target_update} target net update")
+        samples[f"update_target_net/{target_update}"] = repeat(benchmark_target_update, repeats, target_update,
+                                                               target_updates)
+    results = {name: {rate: float(np.median(values)) for rate, values in rates.items()}
+               for name, rates in samples.items()}
+    return results, samples
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+    }
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """
+    Returns (benchmark, rate, baseline rate, current rate) of every median rate that dropped more than threshold below
+    the baseline. When both reports have the rates of every run, a drop only counts if even the fastest current run is
+    slower than the slowest baseline run, so a drop within the noise of the runs is not a regression.
+    Both are reports as written by __main__; benchmarks missing from either are skipped.
+    """
+    regressions = []
+    baseline_samples = baseline.get("samples", {})
+    current_samples = current.get("samples", {})
+    for name, rates in current["results"].items():
+        baseline_rates = baseline["results"].get(name, {})
+        for rate, value in rates.items():
+            if rate not in baseline_rates or value >= baseline_rates[rate] * (1 - threshold):
+                continue
+            baseline_values = baseline_samples.get(name, {}).get(rate)
+            current_values = current_samples.get(name, {}).get(rate)
+            if baseline_values and current_values and max(current_values) >= min(baseline_values):
+                continue
+            regressions.append((name, rate, baseline_rates[rate], value))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the throughput of games, decisions and training steps")
+    parser.add_argument("--quick", action="store_true", help="Fewer games, stock sizes, replay capacities and runs")
+    parser.add_argument("--threads", type=int, default=1, help="Torch threads, 1 gives the most stable numbers")
+    parser.add_argument("--output", help="JSON file to write the results to, a new file in BenchmarkResults by default")
+    parser.add_argument("--compare", help="JSON file of an earlier run, exits with 1 if any rate regressed")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Fraction a rate may drop below the earlier run before it counts as a regression")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    if args.quick:
+        config = {"stock_sizes": [1, 30], "replay_capacities": [10_000], "num_games": 5, "optimize_steps": 20,
+                  "target_updates": 50, "repeats": 3}
+    else:
+        config = {"stock_sizes": STOCK_SIZES, "replay_capacities": REPLAY_CAPACITIES, "num_games": NUM_GAMES,
+                  "optimize_steps": OPTIMIZE_STEPS, "target_updates": TARGET_UPDATES, "repeats": REPEATS}
+    results, samples = run_benchmarks(**config)
+    # Spread of every rate over the runs, relative to its median
+    spread = {name: {rate: (max(values) - min(values)) / results[name][rate] for rate, values in rates.items()}
+              for name, rates in samples.items()}
+    report = {"date": datetime.datetime.now().isoformat(), "environment": environment(), "config": config,
+              "results": results, "spread": spread, "samples": samples}
+
+    output = args.output
+    if output is None:
+        os.makedirs(BENCHMARK_DIR, exist_ok=True)
+        output = os.path.join(BENCHMARK_DIR,
+                              "benchmark" + datetime.datetime.now().strftime("%d%m%Y-%H%M%S") + ".json")
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(baseline, report, args.threshold)
+        for name, rate, baseline_value, value in regressions:
+            print(f"Regression in {name} {rate}: {baseline_value:.1f} -> {value:.1f}"
+                  f" (spread {baseline.get('spread', {}).get(name, {}).get(rate, 0):.0%}"
+                  f" -> {report['spread'][name][rate]:.0%})")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
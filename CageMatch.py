@@ -1,28 +1,56 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import csv
 import datetime
+import hashlib
 import itertools
 import logging
+import multiprocessing
 import os
+import random
 import re
 
-import torch
+import numpy as np
 from tqdm import tqdm
-import pandas as pd
 
 import ComputerPlayer as CP
 import OpponentComputerPlayer as OCP
-from ComputerPlayer import NeuralNetwork
 from Game import Game
+from InferenceServer import InferenceServer
+from MCTSComputerPlayer import MCTSComputerPlayer, shutdown_executors
+from NumpyPolicy import NumpyPolicy
+from Profiler import NULL_PROFILER, Profiler
 from RandomComputerPlayer import RandomComputerPlayer
-from reward_strategies.WinOnlyRewardStrategy import WinOnlyRewardStrategy
+from ResultWriter import ResultWriter
+from RewardEngine import WIN_ONLY
+from Tournament import Tournament
+from TurnPlanner import PlannerComputerPlayer
+from VecSkipBoEnv import VecSkipBoEnv
 
 NUM_GAMES = 100
 NUM_COMPUTER_PLAYERS = 2
 NUM_CARDS = 30
 
 
+def seed_int(seed):
+    """
+    Integer for a string seed, for generators that only take numbers. Unlike hash() it is the same in every process.
+    """
+    return int.from_bytes(hashlib.sha256(seed.encode()).digest()[:8], "little")
+
+
 class Tester:
     def __init__(self, computers, reward_strategies, device_used, models, names, num_comp_players=NUM_COMPUTER_PLAYERS,
-                 num_cards=NUM_CARDS, num_games=NUM_GAMES):
+                 num_cards=NUM_CARDS, num_games=NUM_GAMES, profiler=NULL_PROFILER, seed=None, duplicate=False,
+                 first_game=0):
+        """
+        profiler: Times the phases of every game played by test, see Profiler
+        seed: If set, every game is seeded with seed and its game number, so games are the same wherever they are played
+        duplicate: Play every deal num_comp_players times in a row, with the seats rotated by one each time, so every
+                   model plays every hand. Needs a seed.
+        first_game: Game number of the first game, the games of test are numbered on from it
+        """
+        if duplicate and seed is None:
+            raise ValueError("Duplicate deals need a seed")
         self.computer_types = computers
         self.reward_strategies = reward_strategies
         self.device = device_used
@@ -31,108 +59,355 @@ class Tester:
         self.num_comp_players = num_comp_players
         self.num_cards = num_cards
         self.num_games = num_games
+        self.profiler = profiler
+        self.seed = seed
+        self.duplicate = duplicate
+        self.first_game = first_game
+
+    def deal(self, game_number):
+        """
+        Seed and seat order of a game, see Game
+        """
+        if self.seed is None:
+            return None, None
+        if not self.duplicate:
+            return f"{self.seed}-{game_number}", None
+        deal, rotation = divmod(game_number, self.num_comp_players)
+        seat_order = [(seat + rotation) % self.num_comp_players for seat in range(self.num_comp_players)]
+        return f"{self.seed}-{deal}", seat_order
+
+    def play_game(self, game_number, models):
+        """
+        Plays one game, returns the name of the winner ('lost' if nobody won) and the row for the actions csv
+        """
+        seed, seat_order = self.deal(game_number)
+        game = Game(num_human_players=0, num_computer_players=self.num_comp_players, model=models,
+                    names=self.names, computer_type=self.computer_types,
+                    reward_strategy=self.reward_strategies, device=self.device,
+                    num_stock_cards=self.num_cards, seed=seed, seat_order=seat_order)
+        for player in game.players:
+            player.profiler = self.profiler
+        turns = 0
+        while game.is_game_running:
+            if game.current_player_index == 0:
+                turns += 1
+            game.players[game.current_player_index].play()
+            game.next_turn()
+        if len(game.draw_pile) == 0:
+            winner = 'lost'
+        else:
+            # Check who was the winner based on who has an empty stock pile
+            winner = [player for player in game.players if len(player.stock_pile) == 0][0].name
+        self.profiler.end_episode(game_number, names=self.names, turns=turns)
+        # The players sit in seat order, the columns are in the order of the models like the names
+        actions = [0] * len(game.players)
+        for index, player in zip(game.seat_order, game.players):
+            actions[index] = player.actions
+        return winner, self.names + [game_number, turns] + actions + [winner]
 
-    def test(self):
+    def test(self, num_threads=1):
+        """
+        num_threads: Number of games played at the same time. If more than one, the games share an InferenceServer
+                     per model, so the decisions of all running games are batched into one forward pass.
+        """
         game_winners = {key: 0 for key in self.names}
         game_winners['lost'] = 0
         action_list = []
-        for i in range(self.num_games):
-            game = Game(num_human_players=0, num_computer_players=self.num_comp_players, model=self.models,
-                        names=self.names, computer_type=self.computer_types,
-                        reward_strategy=self.reward_strategies, device=self.device,
-                        num_stock_cards=self.num_cards)
-            current_player_index = 0
-            turns = 0
-            while game.is_game_running:
-                if current_player_index == 0:
-                    turns += 1
-                game.players[current_player_index].play()
-                current_player_index = (current_player_index + 1) % len(game.players)
-            if len(game.draw_pile) == 0:
-                game_winners['lost'] += 1
-            else:
-                # Check who was the winner based on who has an empty stock pile
-                winning_player = [player for player in game.players if len(player.stock_pile) == 0][0]
-                game_winners[winning_player.name] += 1
-            action_list.append(self.names + [i, turns] + [player.actions for player in game.players])
+        game_numbers = range(self.first_game, self.first_game + self.num_games)
+        if num_threads == 1:
+            results = (self.play_game(i, self.models) for i in game_numbers)
+            for winner, actions in results:
+                game_winners[winner] += 1
+                action_list.append(actions)
+            return game_winners, action_list
+
+        # A NumpyPolicy is called directly by every thread, Random players have no model
+        servers = [model if isinstance(model, NumpyPolicy) or model == '' else
+                   InferenceServer(model, max_batch_size=num_threads) for model in self.models]
+        try:
+            with ThreadPoolExecutor(num_threads) as pool:
+                for winner, actions in pool.map(lambda i: self.play_game(i, servers), game_numbers):
+                    game_winners[winner] += 1
+                    action_list.append(actions)
+        finally:
+            for server in servers:
+                if isinstance(server, InferenceServer):
+                    server.close()
         return game_winners, action_list
 
+    def test_vectorized(self, num_envs=256):
+        """
+        Same results as test, but plays num_envs games at once in a VecSkipBoEnv.
+        Only supports two computer players, seat i of the environment is played by self.models[i].
+        The environment deals its own games, so a seed makes the games reproducible but duplicate is not supported.
+        """
+        assert self.num_comp_players == 2
+        if MCTSComputerPlayer in self.computer_types or PlannerComputerPlayer in self.computer_types:
+            raise ValueError("MCTS and planner players search on a Game, they can not play in a VecSkipBoEnv")
+        if self.duplicate:
+            raise ValueError("test_vectorized can not play duplicate deals")
+        game_winners = {key: 0 for key in self.names}
+        game_winners['lost'] = 0
+        action_list = []
+        num_envs = min(num_envs, self.num_games)
+        env = VecSkipBoEnv(num_envs, num_stock_cards=self.num_cards,
+                           opponent_input=OCP.OpponentComputerPlayer in self.computer_types,
+                           seed=None if self.seed is None else seed_int(f"{self.seed}-{self.first_game}"))
+        dims = [OCP.DIM_IN if computer_type == OCP.OpponentComputerPlayer else CP.DIM_IN
+                for computer_type in self.computer_types]
+        obs, mask = env.reset()
+        started = num_envs
+        active = np.ones(num_envs, dtype=bool)
+        while active.any():
+            actions = env.sample_legal_actions(mask)
+            for seat, computer_type in enumerate(self.computer_types):
+                envs = np.nonzero(active & (env.current == seat))[0]
+                if computer_type == RandomComputerPlayer or len(envs) == 0:
+                    continue
+                if isinstance(self.models[seat], NumpyPolicy):
+                    actions[envs] = self.models[seat].select_actions(obs[envs, :dims[seat]], mask[envs])
+                    continue
+                import torch
+                states = torch.from_numpy(obs[envs, :dims[seat]]).to(self.device)
+                masks = torch.from_numpy(mask[envs]).to(self.device)
+                with torch.no_grad():
+                    output = self.models[seat](states)
+                actions[envs] = torch.where(masks == 1, output, float("-inf")).argmax(1).cpu().numpy()
+            obs, mask, _, dones, info = env.step(actions)
+            for env_index in np.nonzero(active & dones)[0]:
+                winner = info["winner"][env_index]
+                winner = 'lost' if winner < 0 else self.names[winner]
+                game_winners[winner] += 1
+                action_list.append(self.names + [self.first_game + len(action_list), int(info["turns"][env_index])]
+                                   + info["actions"][env_index].tolist() + [winner])
+                if started < self.num_games:
+                    started += 1
+                else:
+                    active[env_index] = False
+        return game_winners, action_list
+
+
+def default_device():
+    import torch
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def load_model(model_name, device, backend="numpy"):
+    """
+    backend: "numpy" to return a NumpyPolicy, "torch" for the NeuralNetwork on device, "int8" for a dynamically
+             quantized copy of the NeuralNetwork on CPU (see Quantization.quantize). An int8 model that selects a
+             different action than the original in more than 1 - Quantization.MIN_AGREEMENT of a sample of states is
+             replaced by a NumpyPolicy.
+             Models exported with NumpyPolicy.save (.npz) are loaded without PyTorch, only with the numpy backend.
+    """
+    if model_name.endswith(".npz"):
+        if backend != "numpy":
+            raise ValueError(f"{model_name} is a NumpyPolicy, it can only be played with the numpy backend")
+        return NumpyPolicy.load(os.path.join('models', model_name))
+
+    import torch
+    if backend in ("numpy", "int8"):
+        device = torch.device("cpu")
+    opponent = "opponent" in model_name
+    if opponent:
+        model = CP.NeuralNetwork(OCP.DIM_IN,
+                                 OCP.DIM_OUT,
+                                 OCP.HIDDEN_COUNT,
+                                 OCP.DIM_HIDDEN).to(device)
+    else:
+        model = CP.NeuralNetwork(CP.DIM_IN,
+                                 CP.DIM_OUT,
+                                 CP.HIDDEN_COUNT,
+                                 CP.DIM_HIDDEN).to(device)
+    model.load_state_dict(torch.load(os.path.join('models', model_name), weights_only=True, map_location=device))
+    model.eval()
+    if backend == "int8":
+        import Quantization
+        quantized = Quantization.quantize(model)
+        agreement = Quantization.check_agreement(model, quantized, opponent)
+        if agreement >= Quantization.MIN_AGREEMENT:
+            return quantized
+        print(f"int8 version of {model_name} only agrees on {agreement:.1%} of the actions, using NumPy instead")
+        backend = "numpy"
+    return NumpyPolicy.from_model(model) if backend == "numpy" else model
+
+
+# Models loaded by get_model, every process loads a model the first time it needs it
+loaded_models = {}
+
+
+def get_model(model_name, device, backend):
+    if model_name in ("Random", "MCTS", "Planner"):
+        return ''
+    if (model_name, backend) not in loaded_models:
+        loaded_models[model_name, backend] = load_model(model_name, device, backend)
+    return loaded_models[model_name, backend]
+
+
+def make_tester(names, models, device, num_comp_players, num_cards, num_games, profiler=NULL_PROFILER, seed=None,
+                duplicate=False, first_game=0):
+    """
+    Tester for a matchup between the models with the given names, where "Random" is a RandomComputerPlayer, "MCTS" an
+    MCTSComputerPlayer and "Planner" a PlannerComputerPlayer without a model
+    """
+    computer_types = [RandomComputerPlayer if name == "Random" else MCTSComputerPlayer if name == "MCTS" else
+                      PlannerComputerPlayer if name == "Planner" else
+                      OCP.OpponentComputerPlayer if "opponent" in name else CP.ComputerPlayer for name in names]
+    # only using one type of ComputerPlayer since the difference between players is their reward
+    return Tester(computers=computer_types, device_used=device, models=models,
+                  reward_strategies=[WIN_ONLY, WIN_ONLY], names=names,
+                  num_comp_players=num_comp_players, num_cards=num_cards, num_games=num_games, profiler=profiler,
+                  seed=seed, duplicate=duplicate, first_game=first_game)
+
+
+def init_worker(backend):
+    if backend != "numpy":
+        import torch
+        torch.set_num_threads(1)
+
+
+def play_games(names, game_numbers, num_comp_players, num_cards, backend, seed=None, duplicate=False):
+    """
+    Plays the given games of a matchup in a worker process, returns the (winner, actions row) of every game
+    """
+    device = default_device() if backend == "torch" else None
+    models = [get_model(name, device, backend) for name in names]
+    tester = make_tester(names, models, device, num_comp_players, num_cards, len(game_numbers), seed=seed,
+                         duplicate=duplicate)
+    try:
+        return [tester.play_game(game_number, models) for game_number in game_numbers]
+    finally:
+        # Worker processes of a pool do not run atexit handlers, so the pools of MCTS players are shut down here
+        shutdown_executors()
+
+
+def run_matchups_in_pool(matchups, num_workers, games_per_task, num_comp_players, num_cards, num_games, backend,
+                         seed=None, duplicate=False):
+    """
+    Plays all matchups (lists of model names) in a pool of num_workers processes, with every task playing at most
+    games_per_task games of one matchup. Yields the game winners and action list of every task as soon as it is done,
+    as Tester.test returns them for a matchup.
+    The seed of a game only depends on its game number (see Tester.deal), so seeded games do not depend on the tasks.
+    """
+    with ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_worker, initargs=(backend,)) as pool:
+        tasks = {}
+        for names in matchups:
+            for start in range(0, num_games, games_per_task):
+                game_numbers = list(range(start, min(start + games_per_task, num_games)))
+                task = pool.submit(play_games, names, game_numbers, num_comp_players, num_cards, backend, seed,
+                                   duplicate)
+                tasks[task] = names
+        for task in tqdm(as_completed(tasks), total=len(tasks)):
+            # Forget finished tasks, so their results are freed once they are yielded
+            names = tasks.pop(task)
+            game_winners = {key: 0 for key in names}
+            game_winners['lost'] = 0
+            games = task.result()
+            for winner, _ in games:
+                game_winners[winner] += 1
+            yield game_winners, [actions for _, actions in games]
+
 
 def run_tests(test_these_models, num_comp_players=NUM_COMPUTER_PLAYERS,
-              num_cards=NUM_CARDS, num_games=NUM_GAMES):
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+              num_cards=NUM_CARDS, num_games=NUM_GAMES, num_envs=None, num_threads=1, num_workers=None,
+              games_per_task=25, profile=False, backend="numpy", adaptive=False, parquet=False, seed=None,
+              duplicate=False):
+    """
+    test_these_models: Names of model files in the models directory, "MCTS" adds an MCTSComputerPlayer and
+                       "Planner" a PlannerComputerPlayer as reference
+    num_envs: If set, every matchup plays num_envs games at once with Tester.test_vectorized
+    num_threads: Number of games per matchup played at the same time with batched inference, see Tester.test
+    num_workers: If set, the games are split over a pool of num_workers processes, in tasks of at most games_per_task
+                 games of one matchup
+    profile: Write the time spent per phase of every game to a jsonl file next to the results, see Profiler.
+             Only games played by Tester.test are profiled, so not with num_envs or num_workers.
+    backend: Run the models as a NumpyPolicy ("numpy"), as a NeuralNetwork ("torch") or as an int8 quantized
+             NeuralNetwork ("int8"), see load_model
+    adaptive: Instead of playing num_games games for every matchup, play batches of games for the matchups picked by
+              a Tournament until the ranking is clear, with at most num_games games per matchup. Also writes the
+              ranked Elo ratings to a leaderboard csv. Not supported with num_workers.
+    parquet: Write the actions of every game as parquet instead of csv (needs pyarrow). Either way the games are
+             written while the tests run, see ResultWriter.
+    seed: Seeds every game with seed and its game number, so game i of every matchup has the same deal and the results
+          are the same however the games are played. Random if duplicate is set without a seed.
+    duplicate: Play every deal once for every seating of a matchup, so both models play the same hands and less games
+               are needed to tell them apart. Not supported with num_envs.
+    """
+    if adaptive and num_workers is not None:
+        raise ValueError("An adaptive tournament picks its matchups one at a time, it can not use num_workers")
+    if duplicate and num_envs is not None:
+        raise ValueError("Duplicate deals are played by Tester.test, they can not use num_envs")
+    if duplicate and seed is None:
+        seed = random.randrange(2 ** 32)
+    # Without the torch backend the models run in NumPy, and PyTorch is only imported to read .pth files
+    device = default_device() if backend == "torch" else None
     logname = os.path.join('TestResults',
                            ("cageMatchTest" + datetime.datetime.now().strftime("%d%m%Y-%H%M%S") + ".log"))
     logging.basicConfig(filename=logname, format='%(asctime)s - %(levelname)s - %(message)s', filemode='w')
     logger = logging.getLogger()
     logger.setLevel(logging.NOTSET)
-    print("loading models")
-    models_to_test = []
     # structure for training
     logger.debug("Testing following models: ")
-    for model_name in tqdm(test_these_models):
-        opponent = "opponent" in model_name
-        if opponent:
-            model = NeuralNetwork(OCP.DIM_IN,
-                                  OCP.DIM_OUT,
-                                  OCP.HIDDEN_COUNT,
-                                  OCP.DIM_HIDDEN).to(device)
-        else:
-            model = NeuralNetwork(CP.DIM_IN,
-                                  CP.DIM_OUT,
-                                  CP.HIDDEN_COUNT,
-                                  CP.DIM_HIDDEN).to(device)
-        model.load_state_dict(torch.load(os.path.join('models', model_name), weights_only=True, map_location='cuda'))
-        model.eval()
-        models_to_test.append((model, model_name, opponent))
+    for model_name in test_these_models:
         logger.info(model_name)
-    win_results = []
-    action_results = []
-    print("Testing against randoms")
-    # only using one type of ComputerPlayer since the difference between players is their reward
-    logger.debug("vs Random tests")
-    for (model, name, opponent) in tqdm(models_to_test):
-        tester = Tester(computers=[RandomComputerPlayer, OCP.OpponentComputerPlayer if opponent else CP.ComputerPlayer],
-                        device_used=device, models=['', model],
-                        reward_strategies=[WinOnlyRewardStrategy, WinOnlyRewardStrategy], names=["Random", name],
-                        num_comp_players=num_comp_players, num_cards=num_cards, num_games=num_games)
-        game_winners, action_list = tester.test()
-        win_results.append(game_winners)
-        action_results += action_list
-    print("Testing against each other")
-    matches = list(itertools.combinations(models_to_test, 2))
-    logger.debug("Cage match models")
-    for ((model1, name1, opponent1), (model2, name2, opponent2)) in tqdm(matches):
-        computer_types = [OCP.OpponentComputerPlayer if opponent1 else CP.ComputerPlayer,
-                          OCP.OpponentComputerPlayer if opponent2 else CP.ComputerPlayer]
-        tester = Tester(computers=computer_types, device_used=device, models=[model1, model2],
-                        reward_strategies=[WinOnlyRewardStrategy, WinOnlyRewardStrategy], names=[name1, name2],
-                        num_comp_players=num_comp_players, num_cards=num_cards, num_games=num_games)
-        game_winners, action_list = tester.test()
-        win_results.append(game_winners)
-        action_results += action_list
-    logger.debug("Tests finished")
+    if seed is not None:
+        logger.info(f"Seed {seed}{', duplicate deals' if duplicate else ''}")
+    matchups = [["Random", name] for name in test_these_models]
+    matchups += [[name1, name2] for name1, name2 in itertools.combinations(test_these_models, 2)]
+    writer = ResultWriter(logname.replace(".log", ""), test_these_models + ["Random"], parquet=parquet)
 
-    # Write the win results to a csv file
-    win_results_df = pd.DataFrame(columns=test_these_models + ["Random"], index=test_these_models + ["Random"])
-    for m in win_results:
-        logger.info(m)
-        player_1, player_2 = [name for name in m.keys() if name != "lost"]
-        win_results_df.loc[player_1, player_2] = m[player_1]
-        win_results_df.loc[player_2, player_1] = m[player_2]
-    win_csv_name = logname.replace(".log", "_win.csv")
-    win_results_df.to_csv(win_csv_name, index=False)
+    def record(game_winners, action_list):
+        logger.info(game_winners)
+        writer.add_games(action_list)
+
+    with writer:
+        if num_workers is not None:
+            print(f"Testing {len(matchups)} matchups with {num_workers} workers")
+            for game_winners, action_list in run_matchups_in_pool(matchups, num_workers, games_per_task,
+                                                                  num_comp_players, num_cards, num_games, backend,
+                                                                  seed, duplicate):
+                record(game_winners, action_list)
+        else:
+            profiler = Profiler(logname.replace(".log", "_profile.jsonl")) if profile else NULL_PROFILER
+            print("Testing against randoms, then against each other")
+            logger.debug("vs Random tests, then cage match models")
+            if adaptive:
+                tournament = Tournament(["Random"] + test_these_models, num_games)
+                with tqdm(total=num_games * len(matchups)) as progress:
+                    while (names := tournament.next_pairing()) is not None:
+                        # The games of a matchup are numbered on from its earlier batches
+                        tester = make_tester(names, [get_model(name, device, backend) for name in names], device,
+                                             num_comp_players, num_cards, tournament.games_for(names), profiler,
+                                             seed, duplicate, tournament.games_played(names))
+                        game_winners, action_list = (tester.test(num_threads) if num_envs is None
+                                                     else tester.test_vectorized(num_envs))
+                        tournament.record(names, game_winners)
+                        progress.update(tester.num_games)
+                        record(game_winners, action_list)
+                print(f"Played {writer.num_games} games instead of {num_games * len(matchups)}")
+            else:
+                for names in tqdm(matchups):
+                    tester = make_tester(names, [get_model(name, device, backend) for name in names], device,
+                                         num_comp_players, num_cards, num_games, profiler, seed, duplicate)
+                    record(*(tester.test(num_threads) if num_envs is None else tester.test_vectorized(num_envs)))
+            profiler.close()
+    # The pools of MCTS players live as long as their policy is used, which is until the last matchup
+    shutdown_executors()
+    logger.debug("Tests finished")
 
-    # Write the action results to a csv
-    action_results_df = pd.DataFrame(data=action_results,
-                                     columns=["Player 1", "Player 2", "Game Number", "Turns", "Player 1 Actions Count",
-                                              "Player 2 Actions Count"])
-    actions_csv_name = logname.replace(".log", "_actions.csv")
-    action_results_df.to_csv(actions_csv_name, index=False)
+    if adaptive:
+        leaderboard = tournament.leaderboard()
+        with open(logname.replace(".log", "_leaderboard.csv"), "w", newline="") as file:
+            writer = csv.DictWriter(file, ["rank", "name", "elo", "elo_low", "elo_high", "games"])
+            writer.writeheader()
+            for row in leaderboard:
+                logger.info(row)
+                writer.writerow(row)
 
 
 if __name__ == "__main__":
-    all_models = sorted(os.listdir("models"),
+    all_models = sorted([name for name in os.listdir("models") if name.endswith((".pth", ".npz"))],
                         key=lambda x: ("_".join(x.split("_")[:-1]), int(re.search("[0-9]+", x)[0])))
     models = []
     prev = all_models[0]
@@ -1,26 +1,25 @@
-class Card:
-    """
-    value: The value that a card has in a given context. SkipBo cards (jokers) get assigned their contextual value in a build pile
-    face:  Possible faces are 1,2,..,11,12 and 'S'. Used to address a card when trying to play it.
-    """
-    def __init__(self, face):
-        self.face = face
-        if isinstance(face, int):
-            self.value = face
-        else:  # Face == 'S'
-            self.value = 0
+"""
+Cards are stored as small integers: their face.
+Faces 1,2,..,11,12 are the numbered cards, JOKER is used for SkipBo cards ('S').
+A SkipBo card only gets a value once it is played on a build pile, the build pile keeps track of that value.
+"""
+JOKER = 13
+NUM_FACES = 13
+
+DECK = tuple(face for face in range(1, 13) for _ in range(12)) + (JOKER,) * 18
 
-    # Method used to give joker the value used in a building pile
-    def set_value(self, value):
-        self.value = value
 
-    def __eq__(self, other):
-        if isinstance(other, (int, str)):
-            return self.face == other
-        elif isinstance(other, Card):
-            return self.face == other.face
-        else:
-            return False
+def face_to_str(face):
+    return 'S' if face == JOKER else str(face)
 
-    def __str__(self):
-        return str(self.face)
\ No newline at end of file
+
+def str_to_face(text):
+    """
+    Parses a face as typed by a human player, so '1', .., '12' or 'S'
+    """
+    if text.upper() == 'S':
+        return JOKER
+    face = int(text)
+    if not 1 <= face <= 12:
+        raise ValueError(f"There is no card with face {text}")
+    return face
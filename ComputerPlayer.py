@@ -1,13 +1,17 @@
 import math
-import random
 
+from ActionSpace import (DECODED, DISCARD_TO_BUILD, HAND_TO_DISCARD, KIND_DISCARD_TO_BUILD, KIND_HAND_TO_BUILD,
+                         KIND_HAND_TO_DISCARD, NUM_ACTIONS, NUM_PILES, STOCK_TO_BUILD)
+from Card import NUM_FACES
+from InferenceServer import InferenceServer
+from MaskEngine import MaskEngine
+from NumpyPolicy import NumpyPolicy
 from Player import Player
-
-import torch
-from torch import nn
+from Profiler import NULL_PROFILER
+from StateEncoder import BUILD_OFFSET, DISCARD_OFFSET, STOCK_COUNT_OFFSET, STOCK_OFFSET, StateEncoder
 
 DIM_IN = 127
-DIM_OUT = 124
+DIM_OUT = NUM_ACTIONS
 HIDDEN_COUNT = 3
 DIM_HIDDEN = 500
 
@@ -20,16 +24,68 @@ EPS_START = 0.9
 EPS_END = 0.05
 EPS_DECAY = 10_000
 
+
+def __getattr__(name):
+    # NeuralNetwork needs PyTorch, so it is only imported when it is used
+    if name == "NeuralNetwork":
+        from NeuralNetwork import NeuralNetwork
+        return NeuralNetwork
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def epsilon_threshold(steps_done):
+    return EPS_END + (EPS_START - EPS_END) * math.exp(-steps_done / EPS_DECAY)
+
+
+def select_actions(model, model_inputs, masks, eps_threshold=0.0):
+    """
+    Batched version of ComputerPlayer.select_action: the best legal action per row of model_inputs, or with probability
+    eps_threshold a random legal action
+    """
+    import torch
+    with torch.no_grad():
+        output = model(model_inputs)
+    actions = torch.where(masks == 1, output, float("-inf")).argmax(1)
+    if eps_threshold > 0:
+        explore = torch.rand(len(actions), device=actions.device) < eps_threshold
+        if explore.any():
+            actions[explore] = torch.multinomial(masks[explore], 1).squeeze(1)
+    return actions
+
+
 class ComputerPlayer(Player):
+    with_opponent = False  # Whether the model input includes the opponent, see StateEncoder
+    profiler = NULL_PROFILER  # Times the phases of play, see Profiler
+    uses_model = True  # False if select_action does not use the model
+
     def __init__(self, game, model, device, reward_strategy=None, name=""):
         super().__init__(game)
-        self.mask = torch.zeros(
-            # NOTE: IN THE MASK, ALL CARDS ARE MAPPED TO ONE LOWER, so card 1 is in offset 0 of the mask
-            13 * 4  # For every card to every build pile, so first card 1 to build 0, then card 1 to build 1 etc.
-            + 13 * 4  # For every card to every discard pile, so first card 1 to discard 0, then card 1 to discard 1 etc.
-            + 4 * 4  # From every discard pile to every build pile, so discard 0 to build 0, then discard 0 to build 1 etc.
-            + 4  # From stock pile to every build pile, so first stock to build 0, then stock to build 1
-        ).to(device)
+        self.mask_engine = MaskEngine(self)
+        self.encoder = StateEncoder(self, self.with_opponent)
+        # With a NumpyPolicy, or if the model is not used, mask and model_input are the NumPy buffers of the mask
+        # engine and encoder so the player does not need PyTorch. Otherwise they are tensors the buffers are copied into.
+        self.uses_torch = self.uses_model and not isinstance(model, NumpyPolicy)
+        if not self.uses_torch:
+            self.mask = self.mask_engine.mask
+            self.model_input = self.encoder.buffer
+            self.mask_source = self.input_source = None
+        else:
+            self.init_tensors(device)
+
+        self.reward_strategy = reward_strategy  # RewardSpec of the rewards while training, see RewardEngine
+
+        self.device = device
+        self.model = model
+        self.num_piles = 4
+
+        self.end_turn = False
+        self.name = name
+        self.actions = 0
+
+    def init_tensors(self, device):
+        import torch
+        # NOTE: IN THE MASK, ALL CARDS ARE MAPPED TO ONE LOWER, so card 1 is in offset 0 of the mask, see ActionSpace
+        self.mask = torch.zeros(NUM_ACTIONS).to(device)
 
         self.model_input = torch.zeros(  # NOTE: We doing some bullshit here with card faces compared to offsets
             13  # Hand Cards NOTE: model_input[0] means card 1!
@@ -40,70 +96,35 @@ class ComputerPlayer(Player):
             + 1  # Number of stock cards
             # Could be expanded for Opponents
         ).to(device)
-
-        self.reward_strategy = reward_strategy
-        if self.reward_strategy is not None:
-            self.reward_strategy.register_player(self)
-
-        self.device = device
-        self.model = model
-        self.num_piles = 4
-
-        self.end_turn = False
-        self.name = name
-        self.actions = 0
+        # Tensors sharing memory with the buffers of the mask engine and encoder
+        self.mask_source = torch.from_numpy(self.mask_engine.mask)
+        self.input_source = torch.from_numpy(self.encoder.buffer)
 
     def compute_mask(self):
-        self.mask.zero_()
-        for card in range(13):
-            for pile in range(4):
-                card_face = 'S' if card == 12 else card + 1
-                self.mask[self.num_piles * card + pile] = self.check_hand_to_build(card_face, pile)
-        offset = 13 * 4
-        for card in range(13):
-            card_face = 'S' if card == 12 else card + 1
-            self.mask[offset + self.num_piles * card:
-                      offset + self.num_piles * card + self.num_piles] = self.check_hand_to_discard(
-                card_face, 0)  # Only need to check for 1, not for all piles, as it does not depend on the pile
-        offset = 13 * 4 + 13 * 4
-        for discard_pile in range(4):
-            for build_pile in range(4):
-                self.mask[offset + self.num_piles * discard_pile + build_pile] = self.check_discard_to_build(
-                    discard_pile, build_pile)
-        offset = 13 * 4 + 13 * 4 + 4 * 4
-        for build_pile in range(4):
-            self.mask[offset + build_pile] = self.check_stock_to_build(build_pile)
+        if self.mask_engine.update() and self.mask_source is not None:
+            self.mask.copy_(self.mask_source)
 
     def compute_model_input(self):
-        self.model_input.zero_()
-        for card in self.hand:
-            self.model_input[12 if card.face == "S" else card.face - 1] += 1
-
-        offset = 13
-        for discard_pile in range(4):
-            if len(self.discard_piles[discard_pile]) > 0:
-                card = self.discard_piles[discard_pile][-1]
-                self.model_input[offset + 13 * discard_pile + (12 if card.face == "S" else card.face - 1)] = 1
-
-        offset = 13 + 13 * 4
-        top_off_stock = self.stock_pile[-1]
-        self.model_input[offset + (12 if top_off_stock.face == "S" else top_off_stock.face - 1)] = 1
-
-        offset = 13 + 4 * 13 + 13
-        for build_pile in range(4):
-            card = self.game.get_top_of_build_pile(build_pile)
-            self.model_input[offset + 12 * build_pile + card] = 1
-
-        offset = 13 + 4 * 13 + 13 + 12 * 4
-        self.model_input[offset] = len(self.stock_pile)
+        self.encoder.encode()
+        if self.input_source is not None:
+            self.model_input.copy_(self.input_source)
 
     def select_action(self, training, verbose, steps_done):
-        eps_threshold = EPS_END + (EPS_START - EPS_END) * math.exp(-steps_done / EPS_DECAY)
-        if training and random.random() < eps_threshold:
-            action = torch.multinomial(self.mask, 1).item()
+        if training and self.rng.random() < epsilon_threshold(steps_done):
+            action = int(self.rng.choice(self.mask_engine.legal_actions()))
+        elif isinstance(self.model, InferenceServer):
+            action = self.model.select_action(self.model_input, self.mask)
+        elif isinstance(self.model, NumpyPolicy):
+            if verbose:
+                output = self.model(self.model_input)
+                output[self.mask != 1] = float("-inf")
+                self.pretty_print_output(output)
+            action = self.model.select_action(self.model_input, self.mask_engine.legal_actions())
         else:
+            import torch
             with torch.no_grad():
-                output = self.model(self.model_input)
+                # As a batch of one, the int8 layers of a quantized model (see Quantization) need a 2D input
+                output = self.model(self.model_input.unsqueeze(0))[0]
                 masked_output = torch.where(self.mask == 1, output, float("-inf"))
                 if verbose:
                     self.pretty_print_output(masked_output)
@@ -114,100 +135,88 @@ class ComputerPlayer(Player):
         """
         Returns reward if training is enabled
         """
-        reward = 0  # Justin Case
-
         action = self.select_action(training, verbose, steps_done)
+        return self.do_action(action, training)
 
-        selected_action = action
-        if action < 13 * 4:  # Hand to build
-            face = "S" if action // 4 == 12 else action // 4 + 1
-            build_pile_index = action % 4
-            if training:
-                reward = self.reward_strategy.reward_hand_to_build(face, build_pile_index)
-            else:
-                self.play_hand_to_build(face, build_pile_index)
-        elif 13 * 4 <= action < 13 * 4 + 13 * 4:  # Hand to discard
-            action -= 13 * 4
-            face = "S" if action // 4 == 12 else action // 4 + 1
-            discard_pile_index = action % 4
-            if training:
-                reward = self.reward_strategy.reward_hand_to_discard(face, discard_pile_index)
-            else:
-                self.play_hand_to_discard(face, discard_pile_index)
+    def do_action(self, action, training):
+        """
+        Returns (action, reward) if training is enabled
+        """
+        won = False
+        kind, face, discard_pile_index, pile_index = DECODED[action]
+        if kind == KIND_HAND_TO_BUILD:
+            self.play_hand_to_build(face, pile_index)
+        elif kind == KIND_HAND_TO_DISCARD:
+            self.play_hand_to_discard(face, pile_index)
             self.end_turn = True
-        elif 13 * 4 + 13 * 4 <= action < 13 * 4 + 13 * 4 + 4 * 4:  # Discard to build
-            action -= 13 * 4 + 13 * 4
-            discard_pile_index, build_pile_index = action // 4, action % 4
-            if training:
-                reward = self.reward_strategy.reward_discard_to_build(discard_pile_index, build_pile_index)
-            else:
-                self.play_discard_to_build(discard_pile_index, build_pile_index)
+        elif kind == KIND_DISCARD_TO_BUILD:
+            self.play_discard_to_build(discard_pile_index, pile_index)
         else:  # Stock to build
-            action -= 13 * 4 + 13 * 4 + 4 * 4
-            if training:
-                reward = self.reward_strategy.reward_stock_to_build(action)
-            else:
-                self.play_stock_to_build(action)
+            self.play_stock_to_build(pile_index)
             if len(self.stock_pile) < 1:
+                won = True
                 self.game.is_game_running = False
 
         if training:
-            return selected_action, reward
+            return action, self.reward_strategy.reward(action, won)
 
-    def play(self):
+    def start_turn(self):
+        self.end_turn = False
         self.fill_hand()
+        self.encoder.start_turn()
+
+    def restored(self):
+        # The opponent part of the model input is only encoded at the start of a turn
+        self.encoder.start_turn()
+
+    def play(self):
+        profiler = self.profiler
+        with profiler.phase("refill"):
+            self.start_turn()
 
-        self.end_turn = False
         while not self.end_turn and self.game.is_game_running:
             self.actions += 1
-            self.compute_mask()
-            self.compute_model_input()
+            with profiler.phase("mask"):
+                self.compute_mask()
+            with profiler.phase("encode"):
+                self.compute_model_input()
             # self.print_game_state()  # TODO: Enable this with a DEBUG flag
-            self.select_and_do_action(training=False, verbose=False, steps_done=0)
+            with profiler.phase("select"):
+                action = self.select_action(training=False, verbose=False, steps_done=0)
+            with profiler.phase("transition"):
+                self.do_action(action, training=False)
 
     def pretty_print_mask(self):
         print("Mask:")
-
-        print("Hand to build:")
-        print("-> Build index")
-        print("↓ Card")
-        print(self.mask[:13 * 4].view(13, 4))
-
-        print("Hand to discard:")
-        print("-> Discard index")
-        print("↓ Card")
-        print(self.mask[13 * 4:13 * 4 + 13 * 4].view(13, 4))
-
-        print("Discard to Build:")
-        print("-> Discard index")
-        print("↓ Build index")
-        print(self.mask[13 * 4 + 13 * 4:13 * 4 + 13 * 4 + 4 * 4].view(4, 4))
-
-        print("Stock to build:")
-        print("-> Build index")
-        print(self.mask[13 * 4 + 13 * 4 + 4 * 4:])
+        self.pretty_print_actions(self.mask)
 
     def pretty_print_output(self, output):
         print("Ouput:")
+        self.pretty_print_actions(output)
 
+    @staticmethod
+    def pretty_print_actions(values):
+        """
+        Prints a value per action, like the mask or the model output, in the parts of the ActionSpace layout
+        """
         print("Hand to build:")
         print("-> Build index")
         print("↓ Card")
-        print(output[:13 * 4].view(13, 4))
+        print(values[:HAND_TO_DISCARD].reshape(NUM_FACES, NUM_PILES))
 
         print("Hand to discard:")
         print("-> Discard index")
         print("↓ Card")
-        print(output[13 * 4:13 * 4 + 13 * 4].view(13, 4))
+        print(values[HAND_TO_DISCARD:DISCARD_TO_BUILD].reshape(NUM_FACES, NUM_PILES))
 
         print("Discard to Build:")
         print("-> Discard index")
         print("↓ Build index")
-        print(output[13 * 4 + 13 * 4:13 * 4 + 13 * 4 + 4 * 4].view(4, 4))
+        print(values[DISCARD_TO_BUILD:STOCK_TO_BUILD].reshape(NUM_PILES, NUM_PILES))
 
         print("Stock to build:")
         print("-> Build index")
-        print(output[13 * 4 + 13 * 4 + 4 * 4:])
+        print(values[STOCK_TO_BUILD:])
 
     def pretty_print_input(self):
         print("Input:")
@@ -219,35 +228,19 @@ class ComputerPlayer(Player):
         print("Discard piles:")
         print("-> Card")
         print("↓ Discard Pile")
-        print(self.model_input[13:13 + 13 * 4].view(4, 13))
+        print(self.model_input[DISCARD_OFFSET:STOCK_OFFSET].reshape(NUM_PILES, NUM_FACES))
 
         print("Stock Card:")
         print("-> Card")
-        print(self.model_input[13 + 13 * 4:13 + 13 * 4 + 13])
+        print(self.model_input[STOCK_OFFSET:BUILD_OFFSET])
 
         print("Build piles:")
         print("-> Card")
         print("↓ Build Pile")
-        print(self.model_input[13 + 13 * 4 + 13:13 + 13 * 4 + 13 + 12 * 4].view(4, 12))
+        print(self.model_input[BUILD_OFFSET:STOCK_COUNT_OFFSET].reshape(NUM_PILES, NUM_FACES - 1))
 
         print("Number of stock cards:")
-        print(self.model_input[13 + 13 * 4 + 13 + 12 * 4])
+        print(self.model_input[STOCK_COUNT_OFFSET])
 
     def __str__(self):
         return self.reward_strategy.__str__()
-
-
-class NeuralNetwork(nn.Module):
-    def __init__(self, dim_in, dim_out, num_hidden_layers, dim_hidden):
-        super().__init__()
-        hidden_layers = []
-        for i in range(num_hidden_layers):
-            in_size = dim_in if i == 0 else dim_hidden
-            hidden_layers.append(nn.Linear(in_size, dim_hidden))
-            hidden_layers.append(nn.ReLU())
-        self.linear_relu_stack = nn.Sequential(*hidden_layers)
-        self.output_layer = nn.Linear(dim_hidden, dim_out)
-
-    def forward(self, x):
-        logits = self.linear_relu_stack(x)  # Probabilities passed along the hidden layers
-        return self.output_layer(logits)
@@ -1,18 +1,35 @@
 import os
 import random
-import torch
 
 from Player import *
 import ComputerPlayer as CP
 import OpponentComputerPlayer as OCP
-from Card import *
-from reward_strategies.WinOnlyRewardStrategy import WinOnlyRewardStrategy
+from GameState import GameState
+from NumpyPolicy import NumpyPolicy
+from RewardEngine import WIN_ONLY
+
+
+class GameSnapshot:
+    """
+    Everything of a Game that changes while it is played, see Game.snapshot.
+    state:         Cards of the game, see GameState.snapshot
+    turns:         (end_turn, actions) of every player, in playing order
+    rng_states:    State of the random generator of the game, followed by those of seeded players. None if not taken.
+    """
+    __slots__ = ("state", "current_player_index", "is_game_running", "turns", "rng_states")
+
+    def __init__(self, state, current_player_index, is_game_running, turns, rng_states):
+        self.state = state
+        self.current_player_index = current_player_index
+        self.is_game_running = is_game_running
+        self.turns = turns
+        self.rng_states = rng_states
 
 
 class Game:
 
     def __init__(self, num_human_players, num_computer_players, model, names, computer_type, reward_strategy, device,
-                 num_stock_cards=30):
+                 num_stock_cards=30, seed=None, seat_order=None):
         """
         :param num_human_players:
         :param num_computer_players:
@@ -20,6 +37,10 @@ class Game:
         :param computer_type: Specific subclass of ComputerPlayer
         :param device:
         :param num_stock_cards:
+        :param seed: If set, all shuffles of the game and the random choices of the players are seeded with it.
+                     Player i gets the same random choices whatever its seat, see seat_order.
+        :param seat_order: Indices of the players (computer players first, in the order of model) in playing order,
+                           random if None. The deal of a seeded game only depends on the seed if this is given.
         """
         self.players = []
         if model is None:
@@ -30,68 +51,96 @@ class Game:
             assert len(reward_strategy) == num_computer_players
             for i in range(num_computer_players):
                 self.players.append(
-                    computer_type[i](self, model=model[i], device=device, reward_strategy=reward_strategy[i](),
+                    computer_type[i](self, model=model[i], device=device, reward_strategy=reward_strategy[i],
                                      name=names[i]))
         else:
             for _ in range(num_computer_players):
-                self.players.append(computer_type(self, model=model, device=device, reward_strategy=reward_strategy()))
+                self.players.append(computer_type(self, model=model, device=device, reward_strategy=reward_strategy))
 
         for _ in range(num_human_players):
             self.players.append(HumanPlayer(self))
-        random.shuffle(self.players)
-
-        self.draw_pile = [Card(i) for i in range(1, 13) for _ in range(12)] + [Card('S') for _ in range(18)]
-        random.shuffle(self.draw_pile)
-
-        self.building_piles = [[], [], [], []]
-
-        self.removed_pile = []
+        self.rng = random if seed is None else random.Random(seed)
+        if seed is not None:
+            for player in self.players:
+                player.rng = random.Random(self.rng.getrandbits(64))
+        if seat_order is None:
+            # Shuffling the indices takes the same random numbers as shuffling the players
+            seat_order = list(range(len(self.players)))
+            self.rng.shuffle(seat_order)
+        self.seat_order = seat_order  # Index of the player of every seat, as in the parameter
+        self.players = [self.players[i] for i in seat_order]
+
+        self.state = GameState([player.state for player in self.players], self.rng)
+        self.is_game_running = True
+        self.current_player_index = 0  # Index in players of the player whose turn it is
 
         # Deal cards to the stockpiles of each player
-        # We currently do not support playing with 5 or 6 players
-        for i in range(num_stock_cards):
-            for player in self.players:
-                player.stock_pile.append(self.draw_pile.pop())
+        self.state.deal(num_stock_cards)
 
         # Technically this is not according to the rules, and should be done at the start of each first turn
         for player in self.players:
             player.fill_hand()
 
-        self.is_game_running = True
+    @property
+    def draw_pile(self):
+        return self.state.draw_pile
+
+    @property
+    def removed_pile(self):
+        return self.state.removed_pile
 
     def draw_card(self):
-        if len(self.draw_pile) == 0:
-            # Reshuffle
-            self.draw_pile = self.removed_pile
-            random.shuffle(self.draw_pile)
-            for card in self.draw_pile:
-                if card.face == 'S':
-                    card.value = 0
-            self.removed_pile = []
-        if len(self.draw_pile) == 0:
+        face = self.state.draw_card()
+        if face is None:
             self.is_game_running = False
-            return Card(-1)
-        return self.draw_pile.pop()
+        return face
 
     def get_top_of_build_pile(self, pile_index):
-        pile = self.building_piles[pile_index]
-        if len(pile) == 0:
-            return 0
-        else:
-            return pile[-1].value
+        return self.state.get_top_of_build_pile(pile_index)
 
     def clear_build_pile_if_full(self, pile_index):
-        pile = self.building_piles[pile_index]
-        if len(pile) == 12:
-            self.removed_pile.extend(pile)
-            self.building_piles[pile_index] = []
+        self.state.clear_build_pile_if_full(pile_index)
+
+    def snapshot(self, with_rng=True):
+        """
+        Copy of the state of the game, to go back to with restore. Only the cards, turn and random state are copied,
+        not the players or their models, so this is cheap enough for search and rollouts.
+        with_rng: Also copy the random state, so the draws after restoring are the same as after taking the snapshot
+        """
+        rng_states = None
+        if with_rng:
+            rng_states = (self.rng.getstate(),) + tuple(player.rng.getstate() for player in self.players
+                                                        if player.rng is not self.rng)
+        return GameSnapshot(self.state.snapshot(), self.current_player_index, self.is_game_running,
+                            tuple((getattr(player, "end_turn", False), getattr(player, "actions", 0))
+                                  for player in self.players), rng_states)
+
+    def restore(self, snapshot):
+        """
+        Puts the game back in the state of a snapshot taken of this game
+        """
+        self.state.restore(snapshot.state)
+        self.current_player_index = snapshot.current_player_index
+        self.is_game_running = snapshot.is_game_running
+        for player, (end_turn, actions) in zip(self.players, snapshot.turns):
+            player.end_turn = end_turn
+            player.actions = actions
+        if snapshot.rng_states is not None:
+            self.rng.setstate(snapshot.rng_states[0])
+            for player, rng_state in zip([player for player in self.players if player.rng is not self.rng],
+                                         snapshot.rng_states[1:]):
+                player.rng.setstate(rng_state)
+        for player in self.players:
+            player.restored()
+
+    def next_turn(self):
+        self.current_player_index = (self.current_player_index + 1) % len(self.players)
 
     def start(self):
-        current_player_index = 0
         while self.is_game_running:
-            print(f"It's the turn of player number {current_player_index}. Go wild.")
-            self.players[current_player_index].play()
-            current_player_index = (current_player_index + 1) % len(self.players)
+            print(f"It's the turn of player number {self.current_player_index}. Go wild.")
+            self.players[self.current_player_index].play()
+            self.next_turn()
         if len(self.draw_pile) == 0:
             print("Everyone lost")
         else:
@@ -102,7 +151,6 @@ class Game:
 
 
 if __name__ == '__main__':
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     num_human_players = int(input('How many human players?\n'))
     # Hack to allow training with older Python version
     if num_human_players > 0:
@@ -111,22 +159,30 @@ if __name__ == '__main__':
     num_stock_cards = int(input('How many stock cards do you want to play with? (Default = 30)\n').strip() or "30")
     model_name = input('Please enter a model name:\n')
     opponent = "opponent" in model_name
-    if opponent:
-        model = CP.NeuralNetwork(OCP.DIM_IN,
-                                 OCP.DIM_OUT,
-                                 OCP.HIDDEN_COUNT,
-                                 OCP.DIM_HIDDEN).to(device)
+    device = None
+    if model_name.endswith(".npz"):
+        # Exported with NumpyPolicy.save, so PyTorch is not needed at all
+        model = NumpyPolicy.load(os.path.join("models", model_name))
     else:
-        model = CP.NeuralNetwork(CP.DIM_IN,
-                                 CP.DIM_OUT,
-                                 CP.HIDDEN_COUNT,
-                                 CP.DIM_HIDDEN).to(device)
-    model.load_state_dict(torch.load(os.path.join("models", model_name), weights_only=True))
-    model.eval()
+        import torch
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        if opponent:
+            model = CP.NeuralNetwork(OCP.DIM_IN,
+                                     OCP.DIM_OUT,
+                                     OCP.HIDDEN_COUNT,
+                                     OCP.DIM_HIDDEN).to(device)
+        else:
+            model = CP.NeuralNetwork(CP.DIM_IN,
+                                     CP.DIM_OUT,
+                                     CP.HIDDEN_COUNT,
+                                     CP.DIM_HIDDEN).to(device)
+        model.load_state_dict(torch.load(os.path.join("models", model_name), weights_only=True))
+        # Only playing, so the model does not need PyTorch
+        model = NumpyPolicy.from_model(model)
     names = [f'computer_player_{i}' for i in range(num_computer_players)]
     names += [f'human_player_{i}' for i in range(num_human_players)]
     computer_type = OCP.OpponentComputerPlayer if opponent else CP.ComputerPlayer
-    game = Game(num_human_players, num_computer_players, model, names, computer_type, WinOnlyRewardStrategy, device,
+    game = Game(num_human_players, num_computer_players, model, names, computer_type, WIN_ONLY, device,
                 num_stock_cards)
 
     game.start()
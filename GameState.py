@@ -0,0 +1,166 @@
+from array import array
+import random
+
+from Card import DECK, JOKER, NUM_FACES
+
+NUM_PILES = 4
+HAND_SIZE = 5
+BUILD_PILE_SIZE = 12
+
+
+class PlayerState:
+    """
+    hand:          Faces of the cards in hand
+    hand_counts:   Number of cards in hand per face, indexed by the face (so index 0 is unused)
+    stock_pile:    Faces of the stock cards, the last one is on top
+    discard_piles: Faces of the cards on every discard pile, the last one is on top
+    """
+    __slots__ = ("hand", "hand_counts", "stock_pile", "discard_piles")
+
+    def __init__(self):
+        self.hand = array('B')
+        self.hand_counts = array('B', bytes(NUM_FACES + 1))
+        self.stock_pile = array('B')
+        self.discard_piles = [array('B') for _ in range(NUM_PILES)]
+
+
+class GameState:
+    """
+    All cards of a game, stored as faces (see Card) in small int arrays.
+    draw_pile:    Faces of the cards that can still be drawn, the last one is drawn first
+    removed_pile: Faces of the cards of full build piles, reshuffled into the draw pile when that runs out
+    build_tops:   Value of the top card of every build pile, 0 if it is empty.
+                  As every card has to be one higher than the one below, this is also the number of cards on the pile.
+    build_jokers: Contextual values of the jokers on every build pile, bit (value - 1) is set if a joker has that value
+    players:      PlayerState of every player, in playing order
+    rng:          Shuffles the draw pile, the random module or a random.Random of a seeded game
+    """
+    __slots__ = ("draw_pile", "removed_pile", "build_tops", "build_jokers", "players", "rng")
+
+    def __init__(self, players, rng=random):
+        self.rng = rng
+        self.draw_pile = array('B', DECK)
+        self.rng.shuffle(self.draw_pile)
+        self.removed_pile = array('B')
+        self.build_tops = array('B', bytes(NUM_PILES))
+        self.build_jokers = array('H', bytes(2 * NUM_PILES))
+        self.players = players
+
+    def piles(self):
+        """
+        Every array of the game, in the order of snapshot
+        """
+        piles = [self.draw_pile, self.removed_pile, self.build_tops, self.build_jokers]
+        for player in self.players:
+            piles += [player.hand, player.hand_counts, player.stock_pile, *player.discard_piles]
+        return piles
+
+    def snapshot(self):
+        """
+        Copy of all cards of the game as a tuple of bytes, one per array (see piles). Does not include the state of rng.
+        """
+        return tuple(map(bytes, self.piles()))
+
+    def restore(self, snapshot):
+        """
+        Puts all cards back as they were when snapshot was taken. The arrays are changed in place, so the aliases of the
+        players and the views of their encoders stay valid.
+        """
+        for pile, data in zip(self.piles(), snapshot):
+            if len(pile) * pile.itemsize == len(data):
+                # Also works for the arrays with a view on them, which can not be resized
+                memoryview(pile).cast('B')[:] = data
+            else:
+                del pile[:]
+                pile.frombytes(data)
+
+    def deal(self, num_stock_cards):
+        # We currently do not support playing with 5 or 6 players
+        for _ in range(num_stock_cards):
+            for player in self.players:
+                player.stock_pile.append(self.draw_pile.pop())
+
+    def draw_card(self):
+        """
+        Returns the face of the drawn card, or None if there are no cards left to draw
+        """
+        if len(self.draw_pile) == 0:
+            # Reshuffle, jokers lose their value when their build pile is cleared so there is nothing to reset
+            self.draw_pile.extend(self.removed_pile)
+            self.rng.shuffle(self.draw_pile)
+            del self.removed_pile[:]
+        if len(self.draw_pile) == 0:
+            return None
+        return self.draw_pile.pop()
+
+    def fill_hand(self, player):
+        """
+        Returns False if the hand could not be filled because there are no cards left to draw
+        """
+        while len(player.hand) < HAND_SIZE:
+            face = self.draw_card()
+            if face is None:
+                return False
+            player.hand.append(face)
+            player.hand_counts[face] += 1
+        return True
+
+    def get_top_of_build_pile(self, pile_index):
+        return self.build_tops[pile_index]
+
+    def get_build_pile(self, pile_index):
+        """
+        Faces of the cards on a build pile, from bottom to top
+        """
+        jokers = self.build_jokers[pile_index]
+        return [JOKER if jokers >> (value - 1) & 1 else value for value in
+                range(1, self.build_tops[pile_index] + 1)]
+
+    def play_on_build_pile(self, card_face, pile_index):
+        if card_face == JOKER:
+            self.build_jokers[pile_index] |= 1 << self.build_tops[pile_index]
+        self.build_tops[pile_index] += 1
+        self.clear_build_pile_if_full(pile_index)
+
+    def clear_build_pile_if_full(self, pile_index):
+        if self.build_tops[pile_index] == BUILD_PILE_SIZE:
+            self.removed_pile.extend(self.get_build_pile(pile_index))
+            self.build_tops[pile_index] = 0
+            self.build_jokers[pile_index] = 0
+
+    def fits_on_build_pile(self, card_face, pile_index):
+        return card_face == JOKER or card_face == self.build_tops[pile_index] + 1
+
+    def check_hand_to_build(self, player, card_face, build_index):
+        return player.hand_counts[card_face] > 0 and self.fits_on_build_pile(card_face, build_index)
+
+    def check_discard_to_build(self, player, discard_index, build_index):
+        discard_pile = player.discard_piles[discard_index]
+        return len(discard_pile) > 0 and self.fits_on_build_pile(discard_pile[-1], build_index)
+
+    def check_stock_to_build(self, player, build_index):
+        return self.fits_on_build_pile(player.stock_pile[-1], build_index)
+
+    def remove_from_hand(self, player, card_face):
+        player.hand.remove(card_face)
+        player.hand_counts[card_face] -= 1
+
+    def play_hand_to_build(self, player, card_face, build_index):
+        """
+        Returns False if the hand ran empty and could not be filled again
+        """
+        self.remove_from_hand(player, card_face)
+        self.play_on_build_pile(card_face, build_index)
+        if len(player.hand) == 0:
+            return self.fill_hand(player)
+        return True
+
+    def play_hand_to_discard(self, player, card_face, discard_index):
+        self.remove_from_hand(player, card_face)
+        player.discard_piles[discard_index].append(card_face)
+
+    def play_discard_to_build(self, player, discard_index, build_index):
+        self.play_on_build_pile(player.discard_piles[discard_index].pop(), build_index)
+
+    def play_stock_to_build(self, player, build_index):
+        self.play_on_build_pile(player.stock_pile.pop(), build_index)
@@ -1,3 +1,4 @@
+from Card import str_to_face
 from Player import Player
 
 HELP_STRING = """The commands are:
@@ -31,14 +32,13 @@ class HumanPlayer(Player):
                         else:
                             print("Move not legal")
                     case ["hand", "build", card_face, build_pile_index]:
-                        # TODO Remove str to int transform (Face should be str, value should be int)
-                        card_face = int(card_face) if card_face.isdigit() else card_face
+                        card_face = str_to_face(card_face)
                         if self.check_hand_to_build(card_face, int(build_pile_index)):
                             self.play_hand_to_build(card_face, int(build_pile_index))
                         else:
                             print("Move not legal")
                     case ["hand", "discard", card_face, discard_pile_index]:
-                        card_face = int(card_face) if card_face.isdigit() else card_face
+                        card_face = str_to_face(card_face)
                         if self.check_hand_to_discard(card_face, int(discard_pile_index)):
                             self.play_hand_to_discard(card_face, int(discard_pile_index))
                             end_turn = True
@@ -0,0 +1,98 @@
+import contextlib
+import queue
+import threading
+import time
+
+MAX_BATCH_SIZE = 256
+MAX_WAIT = 0.002  # Seconds
+
+
+class InferenceRequest:
+    def __init__(self, model_input, mask):
+        self.model_input = model_input
+        self.mask = mask
+        self.action = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferenceServer:
+    """
+    Selects the actions of many players that share one model, with one forward pass for all pending decisions.
+    Players in different threads call select_action, a server thread collects their requests until max_batch_size
+    requests are waiting or the first one waited max_wait seconds, runs the model on the batch and hands back the
+    masked argmax actions.
+    A ComputerPlayer uses the server when it is passed as its model.
+    lock: Optional lock held during the forward pass, so the model is not read while it is being trained
+    """
+
+    def __init__(self, model, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT, lock=None):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.lock = lock if lock is not None else contextlib.nullcontext()
+        self.requests = queue.Queue()
+        self.batch_sizes = []
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def select_action(self, model_input, mask):
+        """
+        Blocks until the server has selected the best legal action for model_input
+        """
+        request = InferenceRequest(model_input, mask)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.action
+
+    def _collect_batch(self):
+        first = self.requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                request = self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # Serve what was already collected, then stop
+                self.requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _serve(self):
+        import torch
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+            self.batch_sizes.append(len(batch))
+            try:
+                model_inputs = torch.stack([request.model_input for request in batch])
+                masks = torch.stack([request.mask for request in batch])
+                with self.lock, torch.no_grad():
+                    output = self.model(model_inputs)
+                actions = torch.where(masks == 1, output, float("-inf")).argmax(1).tolist()
+                for request, action in zip(batch, actions):
+                    request.action = action
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
+
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,421 @@
+from array import array
+import atexit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import math
+import multiprocessing
+import random
+import time
+
+import numpy as np
+
+from ActionSpace import (DECODED, DISCARD_TO_BUILD, HAND_TO_DISCARD, KIND_DISCARD_TO_BUILD, KIND_HAND_TO_BUILD,
+                         KIND_HAND_TO_DISCARD, NUM_ACTIONS, NUM_PILES, STOCK_TO_BUILD)
+from Card import JOKER
+from ComputerPlayer import ComputerPlayer, LOSS_REWARD, WIN_REWARD
+from GameState import GameState, PlayerState
+from MaskEngine import MaskEngine
+from NumpyPolicy import policy_of
+from StateEncoder import DIM_IN_OPPONENT, StateEncoder
+
+NUM_SIMULATIONS = 100  # Simulations per decision
+TIME_BUDGET = None  # If set, seconds per decision after which the search stops, even if simulations are left
+EXPLORATION = 1.0  # Weight of the prior in the PUCT score
+FIRST_PLAY_VALUE = 0.5  # Value of actions that were not tried yet
+ROLLOUT_TURNS = 4  # Turns played after the searched turn before the position is evaluated
+MAX_PLAYS_PER_TURN = 200  # Stops rollout turns in which the cards keep going round
+PRIOR_TEMPERATURE = 10.0  # Temperature of the softmax over the Q-values of the model, in reward units
+STOCK_SCALE = 5.0  # Difference in stock cards that makes the heuristic value of a position about 0.88
+NUM_WORKERS = 1  # Independent searches per decision (root parallelism)
+# Prior of the actions without a model, relative to a discard: playing the stock card first, jokers from hand last
+STOCK_PRIOR = 16.0
+BUILD_PRIOR = 4.0
+JOKER_PRIOR = 1.0
+DISCARD_PRIOR = 1.0
+
+# Pools of the searches of MCTS players, shared by all games, see MCTSComputerPlayer.executor
+executors = {}
+# Policy of the searches in a worker process, see init_worker
+worker_policy = None
+
+
+class SimPlayer:
+    __slots__ = ("state", "game")
+
+    def __init__(self, game):
+        self.state = PlayerState()
+        self.game = game
+
+
+class SimGame:
+    """
+    Cards of a game without players or models, restored from a snapshot of a Game to search on.
+    Has the attributes the MaskEngine and StateEncoder of a player need.
+    """
+
+    def __init__(self, num_players, rng):
+        self.players = [SimPlayer(self) for _ in range(num_players)]
+        self.state = GameState([player.state for player in self.players], rng)
+
+    def restore(self, snapshot):
+        self.state.restore(snapshot.state)
+
+
+class Node:
+    """
+    Statistics of the legal actions in a position, for the PUCT selection of AlphaZero
+    """
+    __slots__ = ("actions", "prior", "visits", "values", "total")
+
+    def __init__(self, actions, prior):
+        self.actions = actions
+        self.prior = prior
+        self.visits = np.zeros(len(actions))
+        self.values = np.zeros(len(actions))
+        self.total = 0
+
+    def select(self):
+        """
+        Index in actions of the action to try next
+        """
+        q = np.divide(self.values, self.visits, out=np.full(len(self.actions), FIRST_PLAY_VALUE),
+                      where=self.visits > 0)
+        return int(np.argmax(q + EXPLORATION * self.prior * math.sqrt(self.total + 1) / (1 + self.visits)))
+
+    def update(self, index, value):
+        self.visits[index] += 1
+        self.values[index] += value
+        self.total += 1
+
+
+def heuristic_prior():
+    """
+    Prior of every action of the action space without a model, see the *_PRIOR constants
+    """
+    prior = np.full(NUM_ACTIONS, BUILD_PRIOR)
+    prior[NUM_PILES * (JOKER - 1):HAND_TO_DISCARD] = JOKER_PRIOR
+    prior[HAND_TO_DISCARD:DISCARD_TO_BUILD] = DISCARD_PRIOR
+    prior[STOCK_TO_BUILD:] = STOCK_PRIOR
+    return prior
+
+
+HEURISTIC_PRIOR = heuristic_prior()
+
+
+def determinize(state, player_index, rng):
+    """
+    Shuffles the cards player_index can not see: the draw pile, the hands of the other players and every stock card
+    below the top. Every pile keeps its size, so the result is a game that is consistent with what the player knows.
+    rng: NumPy Generator, its permutation is a lot faster than random.shuffle
+    """
+    players = state.players
+    hidden = [state.draw_pile]
+    for index, player in enumerate(players):
+        if index != player_index:
+            hidden.append(player.hand)
+        hidden.append(player.stock_pile[:-1])
+    cards = rng.permutation(np.frombuffer(b"".join(map(bytes, hidden)), dtype=np.uint8)).tobytes()
+    position = len(state.draw_pile)
+    state.draw_pile[:] = array('B', cards[:position])
+    for index, player in enumerate(players):
+        if index != player_index:
+            size = len(player.hand)
+            player.hand[:] = array('B', cards[position:position + size])
+            position += size
+            counts = player.hand_counts
+            for face in range(len(counts)):
+                counts[face] = 0
+            for face in player.hand:
+                counts[face] += 1
+        size = max(len(player.stock_pile) - 1, 0)
+        player.stock_pile[:size] = array('B', cards[position:position + size])
+        position += size
+
+
+def state_key(player, state):
+    """
+    Compact key of what a player sees during its turn: its hand, the build piles, the tops of its discard piles, the
+    top of its stock pile and the number of stock cards
+    """
+    stock_pile = player.stock_pile
+    return (bytes(player.hand_counts) + bytes(state.build_tops)
+            + bytes([pile[-1] if len(pile) > 0 else 0 for pile in player.discard_piles])
+            + bytes([stock_pile[-1] if len(stock_pile) > 0 else 0, len(stock_pile)]))
+
+
+def apply_action(state, player, action):
+    """
+    Plays an action of the ActionSpace layout. Returns (end_turn, game_over).
+    """
+    kind, face, discard_index, pile_index = DECODED[action]
+    if kind == KIND_HAND_TO_BUILD:
+        game_over = not state.play_hand_to_build(player, face, pile_index)
+        return game_over, game_over
+    if kind == KIND_HAND_TO_DISCARD:
+        state.play_hand_to_discard(player, face, pile_index)
+        return True, False
+    if kind == KIND_DISCARD_TO_BUILD:
+        state.play_discard_to_build(player, discard_index, pile_index)
+        return False, False
+    state.play_stock_to_build(player, pile_index)
+    won = len(player.stock_pile) == 0
+    return won, won
+
+
+def play_on_any_build_pile(build_tops, face):
+    """
+    Index of a build pile face fits on, None if there is none
+    """
+    if face == JOKER:
+        return 0
+    return build_tops.index(face - 1) if face - 1 in build_tops else None
+
+
+def play_greedy_turn(state, player, rng, refill=True):
+    """
+    Plays (the rest of) a turn with a fast heuristic: play the stock card if possible, then numbered cards from the
+    hand and the discard piles, then jokers only if they make the stock card fit. Ends with discarding the highest
+    card in hand. Returns True if the game is over.
+    """
+    if refill and not state.fill_hand(player):
+        return True
+    stock_pile = player.stock_pile
+    hand_counts = player.hand_counts
+    discard_piles = player.discard_piles
+    build_tops = state.build_tops
+    for _ in range(MAX_PLAYS_PER_TURN):
+        build_index = play_on_any_build_pile(build_tops, stock_pile[-1])
+        if build_index is not None:
+            state.play_stock_to_build(player, build_index)
+            if len(stock_pile) == 0:
+                return True
+            continue
+        build_index = next((build_index for build_index, top in enumerate(build_tops) if hand_counts[top + 1] > 0),
+                           None)
+        if build_index is not None:
+            if not state.play_hand_to_build(player, build_tops[build_index] + 1, build_index):
+                return True
+            continue
+        discard_index = next((discard_index for discard_index, pile in enumerate(discard_piles)
+                              if len(pile) > 0 and pile[-1] != JOKER and pile[-1] - 1 in build_tops), None)
+        if discard_index is not None:
+            state.play_discard_to_build(player, discard_index, build_tops.index(discard_piles[discard_index][-1] - 1))
+            continue
+        if hand_counts[JOKER] > 0 and stock_pile[-1] != JOKER and stock_pile[-1] - 2 in build_tops:
+            # A joker on a pile one below the stock card
+            if not state.play_hand_to_build(player, JOKER, build_tops.index(stock_pile[-1] - 2)):
+                return True
+            continue
+        break
+    face = max(player.hand, key=lambda face: face != JOKER and face)
+    # Prefer a pile the card continues downwards, then an empty pile
+    discard_index = next((index for index, pile in enumerate(discard_piles)
+                          if len(pile) > 0 and pile[-1] == face + 1), None)
+    if discard_index is None:
+        discard_index = next((index for index, pile in enumerate(discard_piles) if len(pile) == 0), None)
+    if discard_index is None:
+        discard_index = rng.randrange(NUM_PILES)
+    state.play_hand_to_discard(player, face, discard_index)
+    return False
+
+
+def outcome(state, player_index):
+    """
+    Value of a finished game for player_index: 1 if it won, 0 if another player won, 0.5 if nobody did
+    """
+    for index, player in enumerate(state.players):
+        if len(player.stock_pile) == 0:
+            return 1.0 if index == player_index else 0.0
+    return 0.5
+
+
+def heuristic_value(state, player_index):
+    """
+    Estimate of the chance to win from the number of stock cards left
+    """
+    own = len(state.players[player_index].stock_pile)
+    others = min(len(player.stock_pile) for index, player in enumerate(state.players) if index != player_index)
+    return 0.5 + 0.5 * math.tanh((others - own) / STOCK_SCALE)
+
+
+class Search:
+    """
+    Monte Carlo tree search over the decisions of one player in its current turn. Every simulation samples the hidden
+    cards (see determinize), follows the tree with PUCT, adds a node and plays the game on with play_greedy_turn for
+    ROLLOUT_TURNS turns. Positions are stored in a transposition table by state_key, so different orders of the same
+    plays share their statistics.
+    With a policy, it gives the prior of new nodes (a softmax over its Q-values) and values the end of a rollout.
+    """
+
+    def __init__(self, num_players, player_index, policy, seed):
+        self.rng = random.Random(seed)
+        self.numpy_rng = np.random.default_rng(seed)
+        self.game = SimGame(num_players, self.rng)
+        self.player_index = player_index
+        self.player = self.game.players[player_index]
+        self.mask_engine = MaskEngine(self.player)
+        self.policy = policy
+        if policy is not None:
+            self.encoder = StateEncoder(self.player, policy.dim_in == DIM_IN_OPPONENT)
+        self.table = {}
+
+    def q_values(self):
+        self.mask_engine.update()
+        actions = self.mask_engine.legal_actions()
+        return actions, self.policy.forward(self.encoder.encode()[np.newaxis])[0][actions]
+
+    def expand(self):
+        if self.policy is None:
+            self.mask_engine.update()
+            actions = self.mask_engine.legal_actions()
+            prior = HEURISTIC_PRIOR[actions]
+            return Node(actions, prior / prior.sum())
+        actions, q = self.q_values()
+        prior = np.exp((q - q.max()) / PRIOR_TEMPERATURE)
+        return Node(actions, prior / prior.sum())
+
+    def policy_value(self):
+        """
+        Value of the start of a turn of the player by the best Q-value of the policy, scaled from the loss to the win
+        reward
+        """
+        self.encoder.start_turn()
+        _, q = self.q_values()
+        return min(max((q.max() - LOSS_REWARD) / (WIN_REWARD - LOSS_REWARD), 0.0), 1.0)
+
+    def rollout(self, end_turn):
+        state = self.game.state
+        players = state.players
+        current = self.player_index
+        if not end_turn and play_greedy_turn(state, players[current], self.rng, refill=False):
+            return outcome(state, self.player_index)
+        turns = 0
+        while True:
+            current = (current + 1) % len(players)
+            if turns >= ROLLOUT_TURNS and current == self.player_index:
+                if self.policy is not None:
+                    if not state.fill_hand(players[current]):
+                        return outcome(state, self.player_index)
+                    return self.policy_value()
+                return heuristic_value(state, self.player_index)
+            if play_greedy_turn(state, players[current], self.rng):
+                return outcome(state, self.player_index)
+            turns += 1
+
+    def simulate(self, snapshot):
+        self.game.restore(snapshot)
+        determinize(self.game.state, self.player_index, self.numpy_rng)
+        if self.policy is not None:
+            self.encoder.start_turn()
+        path = []
+        end_turn = game_over = False
+        while True:
+            key = state_key(self.player.state, self.game.state)
+            node = self.table.get(key)
+            if node is None:
+                self.table[key] = self.expand()
+                break
+            index = node.select()
+            path.append((node, index))
+            end_turn, game_over = apply_action(self.game.state, self.player.state, int(node.actions[index]))
+            if end_turn:
+                break
+        value = outcome(self.game.state, self.player_index) if game_over else self.rollout(end_turn)
+        for node, index in path:
+            node.update(index, value)
+
+    def run(self, snapshot, num_simulations, time_budget=None):
+        """
+        Returns the number of visits of every action of the root, as an array over the whole action space
+        """
+        deadline = None if time_budget is None else time.perf_counter() + time_budget
+        for _ in range(num_simulations):
+            self.simulate(snapshot)
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+        visits = np.zeros(NUM_ACTIONS)
+        self.game.restore(snapshot)
+        root = self.table.get(state_key(self.player.state, self.game.state))
+        if root is not None:
+            visits[root.actions] = root.visits
+        return visits
+
+
+def search(snapshot, player_index, num_simulations, time_budget, seed, policy):
+    return Search(len(snapshot.turns), player_index, policy, seed).run(snapshot, num_simulations, time_budget)
+
+
+def init_worker(policy):
+    global worker_policy
+    worker_policy = policy
+
+
+def search_in_worker(snapshot, player_index, num_simulations, time_budget, seed):
+    return search(snapshot, player_index, num_simulations, time_budget, seed, worker_policy)
+
+
+def shutdown_executors():
+    """
+    Shuts down the pools of the searches of all MCTS players, players that search again start new ones
+    """
+    while executors:
+        executors.popitem()[1].shutdown()
+
+
+atexit.register(shutdown_executors)
+
+
+class MCTSComputerPlayer(ComputerPlayer):
+    """
+    Picks every action with a Monte Carlo tree search (see Search), optionally guided by a trained model.
+    Settings other than the defaults can be given with functools.partial, as Game creates the players.
+    num_workers: Independent searches per decision, their root visits are added up (root parallelism). They run in
+                 threads, or in processes with use_processes, which is faster as the search is mostly Python.
+    """
+    uses_model = False  # The model is only used by the search, as a NumpyPolicy
+
+    def __init__(self, game, model, device, reward_strategy=None, name="", num_simulations=NUM_SIMULATIONS,
+                 time_budget=TIME_BUDGET, num_workers=NUM_WORKERS, use_processes=False):
+        super().__init__(game, model, device, reward_strategy, name)
+        self.policy = policy_of(model)
+        self.num_simulations = num_simulations
+        self.time_budget = time_budget
+        self.num_workers = num_workers
+        self.use_processes = use_processes
+
+    def executor(self):
+        """
+        Pool of the searches, shared by all players with the same settings and policy until shutdown_executors
+        """
+        key = (self.use_processes, self.num_workers, self.policy)
+        if key not in executors:
+            if self.use_processes:
+                executors[key] = ProcessPoolExecutor(self.num_workers, mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=init_worker, initargs=(self.policy,))
+            else:
+                executors[key] = ThreadPoolExecutor(self.num_workers)
+        return executors[key]
+
+    def root_visits(self):
+        snapshot = self.game.snapshot(with_rng=False)
+        player_index = self.game.players.index(self)
+        seeds = [self.rng.getrandbits(64) for _ in range(self.num_workers)]
+        if self.num_workers == 1:
+            return search(snapshot, player_index, self.num_simulations, self.time_budget, seeds[0], self.policy)
+        simulations = [len(part) for part in np.array_split(np.arange(self.num_simulations), self.num_workers)]
+        if self.use_processes:
+            tasks = [self.executor().submit(search_in_worker, snapshot, player_index, count, self.time_budget, seed)
+                     for count, seed in zip(simulations, seeds)]
+        else:
+            tasks = [self.executor().submit(search, snapshot, player_index, count, self.time_budget, seed, self.policy)
+                     for count, seed in zip(simulations, seeds)]
+        return sum(task.result() for task in tasks)
+
+    def select_action(self, training, verbose, steps_done):
+        legal = self.mask_engine.legal_actions()
+        if len(legal) == 1:
+            return int(legal[0])
+        visits = self.root_visits()
+        if visits[legal].max() == 0:
+            # The time budget ran out before the first simulation finished
+            return int(self.rng.choice(legal))
+        return int(np.argmax(visits))
@@ -0,0 +1,93 @@
+import numpy as np
+
+from ActionSpace import DISCARD_TO_BUILD, HAND_TO_DISCARD, NUM_ACTIONS, NUM_PILES, STOCK_TO_BUILD, legal_actions
+from Card import JOKER, NUM_FACES
+
+MASK_SIZE = NUM_ACTIONS  # The layout of the mask is described in ActionSpace
+
+
+class MaskEngine:
+    """
+    Keeps the legal action mask of a player up to date in a NumPy buffer.
+    Remembers which faces were in hand and the tops of the build, discard and stock piles the mask was computed for,
+    so an update only rewrites the entries that depend on a value that changed since the last update.
+    """
+
+    def __init__(self, player):
+        self.player = player
+        self.mask = np.zeros(MASK_SIZE, dtype=np.float32)
+        self.in_hand = [False] * (NUM_FACES + 1)  # Indexed by face
+        self.build_tops = [None] * NUM_PILES  # None means the mask was never computed for that pile
+        self.discard_tops = [None] * NUM_PILES  # Face of the top card, 0 if the pile is empty
+        self.stock_top = None
+        self.legal = None  # Cached result of legal_actions, None if the mask changed since
+
+    def update(self):
+        """
+        Returns True if the mask changed
+        """
+        player_state = self.player.state
+        build_tops = self.player.game.state.build_tops
+        discard_tops = [pile[-1] if len(pile) > 0 else 0 for pile in player_state.discard_piles]
+        stock_pile = player_state.stock_pile
+        stock_top = stock_pile[-1] if len(stock_pile) > 0 else 0
+        mask = self.mask
+        in_hand = self.in_hand
+        changed = False
+
+        for build_index in range(NUM_PILES):
+            old_top, top = self.build_tops[build_index], build_tops[build_index]
+            if old_top == top:
+                continue
+            changed = True
+            self.build_tops[build_index] = top
+            # Hand to build, only the face that used to fit and the face that fits now are affected
+            faces = range(1, JOKER) if old_top is None else (old_top + 1, top + 1)
+            for face in faces:
+                mask[NUM_PILES * (face - 1) + build_index] = in_hand[face] and face == top + 1
+            for discard_index in range(NUM_PILES):
+                discard_top = discard_tops[discard_index]
+                mask[DISCARD_TO_BUILD + NUM_PILES * discard_index + build_index] = \
+                    discard_top == JOKER or (discard_top != 0 and discard_top == top + 1)
+            mask[STOCK_TO_BUILD + build_index] = stock_top == JOKER or (stock_top != 0 and stock_top == top + 1)
+
+        hand_counts = player_state.hand_counts
+        for face in range(1, NUM_FACES + 1):
+            present = hand_counts[face] > 0
+            if present == in_hand[face]:
+                continue
+            changed = True
+            in_hand[face] = present
+            row = NUM_PILES * (face - 1)
+            for build_index in range(NUM_PILES):
+                mask[row + build_index] = present and (face == JOKER or face == build_tops[build_index] + 1)
+            mask[HAND_TO_DISCARD + row:HAND_TO_DISCARD + row + NUM_PILES] = present
+
+        for discard_index in range(NUM_PILES):
+            discard_top = discard_tops[discard_index]
+            if discard_top == self.discard_tops[discard_index]:
+                continue
+            changed = True
+            self.discard_tops[discard_index] = discard_top
+            row = DISCARD_TO_BUILD + NUM_PILES * discard_index
+            for build_index in range(NUM_PILES):
+                mask[row + build_index] = \
+                    discard_top == JOKER or (discard_top != 0 and discard_top == build_tops[build_index] + 1)
+
+        if stock_top != self.stock_top:
+            changed = True
+            self.stock_top = stock_top
+            for build_index in range(NUM_PILES):
+                mask[STOCK_TO_BUILD + build_index] = \
+                    stock_top == JOKER or (stock_top != 0 and stock_top == build_tops[build_index] + 1)
+        if changed:
+            self.legal = None
+        return changed
+
+    def legal_actions(self):
+        """
+        Indices of the legal actions of the last update, see ActionSpace.legal_actions
+        """
+        if self.legal is None:
+            self.legal = legal_actions(self.mask)
+        return self.legal
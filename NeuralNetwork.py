@@ -0,0 +1,17 @@
+from torch import nn
+
+
+class NeuralNetwork(nn.Module):
+    def __init__(self, dim_in, dim_out, num_hidden_layers, dim_hidden):
+        super().__init__()
+        hidden_layers = []
+        for i in range(num_hidden_layers):
+            in_size = dim_in if i == 0 else dim_hidden
+            hidden_layers.append(nn.Linear(in_size, dim_hidden))
+            hidden_layers.append(nn.ReLU())
+        self.linear_relu_stack = nn.Sequential(*hidden_layers)
+        self.output_layer = nn.Linear(dim_hidden, dim_out)
+
+    def forward(self, x):
+        logits = self.linear_relu_stack(x)  # Probabilities passed along the hidden layers
+        return self.output_layer(logits)
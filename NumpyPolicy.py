@@ -0,0 +1,133 @@
+import threading
+import weakref
+
+import numpy as np
+
+from ActionSpace import best_legal_action
+
+
+class NumpyPolicy:
+    """
+    Inference only copy of a trained NeuralNetwork that runs in NumPy, without the per call overhead of PyTorch.
+    The weights are stored transposed and contiguous, so a layer is one matmul into a preallocated scratch buffer
+    followed by an in place bias add and ReLU. Scratch buffers are kept per thread and per batch size, so one policy
+    can be shared by games in different threads.
+    A ComputerPlayer uses it when it is passed as its model, see ComputerPlayer.select_action.
+    """
+
+    def __init__(self, weights, biases):
+        """
+        weights: Weight matrix per linear layer, in the (out_features, in_features) layout of torch.nn.Linear
+        biases: Bias vector per linear layer
+        """
+        self.weights = [np.ascontiguousarray(np.asarray(weight, dtype=np.float32).T) for weight in weights]
+        self.biases = [np.ascontiguousarray(bias, dtype=np.float32) for bias in biases]
+        self.dim_in = self.weights[0].shape[0]
+        self.dim_out = self.weights[-1].shape[1]
+        self.local = threading.local()
+
+    def __getstate__(self):
+        # The scratch buffers are per thread, so they are not copied to other processes
+        return {key: value for key, value in self.__dict__.items() if key != "local"}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    @classmethod
+    def from_state_dict(cls, state_dict):
+        """
+        Policy of a NeuralNetwork state dict: the layers of linear_relu_stack in order, then output_layer
+        """
+        hidden = sorted({int(key.split(".")[1]) for key in state_dict if key.startswith("linear_relu_stack.")})
+        prefixes = [f"linear_relu_stack.{index}" for index in hidden] + ["output_layer"]
+        weights = [state_dict[f"{prefix}.weight"].detach().cpu().numpy() for prefix in prefixes]
+        biases = [state_dict[f"{prefix}.bias"].detach().cpu().numpy() for prefix in prefixes]
+        return cls(weights, biases)
+
+    @classmethod
+    def from_model(cls, model):
+        return cls.from_state_dict(model.state_dict())
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a policy saved by save
+        """
+        with np.load(path) as arrays:
+            count = len(arrays.files) // 2
+            return cls([arrays[f"weight_{i}"].T for i in range(count)], [arrays[f"bias_{i}"] for i in range(count)])
+
+    def save(self, path):
+        arrays = {}
+        for i, (weight, bias) in enumerate(zip(self.weights, self.biases)):
+            arrays[f"weight_{i}"] = weight
+            arrays[f"bias_{i}"] = bias
+        np.savez(path, **arrays)
+
+    def _buffers(self, batch_size):
+        buffers = getattr(self.local, "buffers", None)
+        if buffers is None:
+            buffers = self.local.buffers = {}
+        layer_buffers = buffers.get(batch_size)
+        if layer_buffers is None:
+            layer_buffers = buffers[batch_size] = [np.empty((batch_size, weight.shape[1]), dtype=np.float32)
+                                                   for weight in self.weights]
+        return layer_buffers
+
+    def forward(self, model_inputs):
+        """
+        Q-values of a batch of model inputs, the result is a scratch buffer that is overwritten by the next call
+        """
+        x = model_inputs
+        buffers = self._buffers(len(model_inputs))
+        last = len(self.weights) - 1
+        for i, (weight, bias, out) in enumerate(zip(self.weights, self.biases, buffers)):
+            np.matmul(x, weight, out=out)
+            out += bias
+            if i < last:
+                np.maximum(out, 0, out=out)
+            x = out
+        return x
+
+    def __call__(self, model_input):
+        """
+        Q-values of one model input or a batch of them, as a new array
+        """
+        if model_input.ndim == 1:
+            return self.forward(model_input[np.newaxis])[0].copy()
+        return self.forward(model_input).copy()
+
+    def select_actions(self, model_inputs, masks):
+        """
+        Best legal action per row of model_inputs, masks has a 1 for every legal action
+        """
+        output = self.forward(model_inputs)
+        output[masks != 1] = -np.inf
+        return output.argmax(1)
+
+    def select_action(self, model_input, legal):
+        """
+        Best legal action of one model input, legal holds the indices of the legal actions (see ActionSpace)
+        """
+        return best_legal_action(self.forward(model_input[np.newaxis])[0], legal)
+
+
+# Policies made by policy_of, by model, so the players of all games of a model share one policy
+converted_policies = weakref.WeakKeyDictionary()
+
+
+def policy_of(model):
+    """
+    NumpyPolicy for the model of a player that searches with it: None without a model (None or ''), the model itself if
+    it is a NumpyPolicy, otherwise a NumpyPolicy of the model. A model is converted once, so changes to its weights
+    after the first call are not seen.
+    """
+    if model is None or isinstance(model, str):
+        return None
+    if isinstance(model, NumpyPolicy):
+        return model
+    policy = converted_policies.get(model)
+    if policy is None:
+        policy = converted_policies[model] = NumpyPolicy.from_model(model)
+    return policy
@@ -1,16 +1,19 @@
+from ActionSpace import NUM_ACTIONS, NUM_PILES
+from Card import NUM_FACES
 from ComputerPlayer import ComputerPlayer
-
-import torch
+from StateEncoder import OPPONENT_OFFSET, OPPONENT_STOCK_COUNT_OFFSET, OPPONENT_STOCK_OFFSET
 
 DIM_IN = 193
-DIM_OUT = 124
+DIM_OUT = NUM_ACTIONS
 HIDDEN_COUNT = 3
 DIM_HIDDEN = 500
 
 class OpponentComputerPlayer(ComputerPlayer):
-    def __init__(self, game, model, device, reward_strategy=None, name=""):
-        super().__init__(game, model, device, reward_strategy, name)
+    with_opponent = True
 
+    def init_tensors(self, device):
+        import torch
+        super().init_tensors(device)
         self.model_input = torch.zeros(  # NOTE: We doing some bullshit here with card faces compared to offsets
             13  # Hand Cards NOTE: model_input[0] means card 1!
             + 13 * 4  # One hot encodings for each discard pile # here again, card 1 goes to offset 0
@@ -24,23 +27,6 @@ class OpponentComputerPlayer(ComputerPlayer):
             + 1  # Number of stock cards
         ).to(device)
 
-    def compute_model_input(self):
-        super().compute_model_input()
-
-        opponent = self.game.players[0] if self.game.players[0] != self else self.game.players[1]
-        offset = 13 + 4 * 13 + 13 + 12 * 4 + 1
-        for discard_pile in range(4):
-            if len(opponent.discard_piles[discard_pile]) > 0:
-                card = opponent.discard_piles[discard_pile][-1]
-                self.model_input[offset + 13 * discard_pile + (12 if card.face == "S" else card.face - 1)] = 1
-
-        offset = 13 + 4 * 13 + 13 + 12 * 4 + 1 + 13 * 4
-        top_off_stock = opponent.stock_pile[-1]
-        self.model_input[offset + (12 if top_off_stock.face == "S" else top_off_stock.face - 1)] = 1
-
-        offset = 13 + 4 * 13 + 13 + 12 * 4 + 1 + 13 * 4 + 13
-        self.model_input[offset] = len(opponent.stock_pile)
-
     def pretty_print_input(self):
         super().pretty_print_input()
 
@@ -48,14 +34,14 @@ class OpponentComputerPlayer(ComputerPlayer):
         print("Discard piles:")
         print("-> Card")
         print("↓ Discard Pile")
-        print(self.model_input[13 + 4 * 13 + 13 + 12 * 4 + 1:13 + 4 * 13 + 13 + 12 * 4 + 1 + 13 * 4].view(4, 13))
+        print(self.model_input[OPPONENT_OFFSET:OPPONENT_STOCK_OFFSET].reshape(NUM_PILES, NUM_FACES))
 
         print("Stock Card:")
         print("-> Card")
-        print(self.model_input[13 + 4 * 13 + 13 + 12 * 4 + 1 + 13 * 4:13 + 4 * 13 + 13 + 12 * 4 + 1 + 13 * 4 + 13])
+        print(self.model_input[OPPONENT_STOCK_OFFSET:OPPONENT_STOCK_COUNT_OFFSET])
 
         print("Number of stock cards:")
-        print(self.model_input[13 + 4 * 13 + 13 + 12 * 4 + 1 + 13 * 4 + 13])
+        print(self.model_input[OPPONENT_STOCK_COUNT_OFFSET])
 
     def __str__(self):
         return f"opponent_{self.reward_strategy}"
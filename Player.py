@@ -1,99 +1,66 @@
 from abc import ABC, abstractmethod
+from array import array
+import random
 
-import Card
+from Card import face_to_str
+from GameState import PlayerState
 
 class Player(ABC):
-    hand: list[Card.Card]
-    discard_piles: list[list[Card.Card]]
-    stock_pile: list[Card.Card]
+    hand: array
+    discard_piles: list[array]
+    stock_pile: array
+    # Random choices of the player, a seeded game gives every player its own random.Random
+    rng = random
 
     def __init__(self, game):
-        self.hand = []
-        self.discard_piles = [[], [], [], []]
-        self.stock_pile = []
+        # The piles are stored as card faces in the arrays of self.state, these attributes are aliases of them
+        self.state = PlayerState()
+        self.hand = self.state.hand
+        self.discard_piles = self.state.discard_piles
+        self.stock_pile = self.state.stock_pile
         self.game = game
 
     @abstractmethod
     def play(self):
         pass
 
+    def restored(self):
+        """
+        Called after the game is restored from a snapshot, to update anything derived from the cards
+        """
+        pass
+
     def fill_hand(self):
-        while len(self.hand) < 5:
-            self.hand.append(self.game.draw_card())
+        if not self.game.state.fill_hand(self.state):
+            self.game.is_game_running = False
 
     def is_face_in_hand(self, card_face):
-        return card_face in [card.face for card in self.hand]
+        return self.state.hand_counts[card_face] > 0
 
     def check_hand_to_build(self, card_face, build_index):
-        if self.is_face_in_hand(card_face):
-            if card_face == 'S':
-                return True
-            else:
-                return card_face == self.game.get_top_of_build_pile(build_index) + 1
-        else:
-            return False
+        return self.game.state.check_hand_to_build(self.state, card_face, build_index)
 
     def check_hand_to_discard(self, card_face, discard_index):
         return self.is_face_in_hand(card_face)
 
     def check_discard_to_build(self, discard_index, build_index):
-        if len(self.discard_piles[discard_index]) == 0:
-            return False
-        elif self.discard_piles[discard_index][-1].face == 'S':
-            return True
-        else:
-            return self.discard_piles[discard_index][-1].value == self.game.get_top_of_build_pile(build_index) + 1
+        return self.game.state.check_discard_to_build(self.state, discard_index, build_index)
 
     def check_stock_to_build(self, build_index):
-        if self.stock_pile[-1].face == 'S':
-            return True
-        else:
-            return self.stock_pile[-1].value == self.game.get_top_of_build_pile(build_index) + 1
-
-    def get_card_from_hand(self, card_face):
-        play_card = next(card for card in self.hand if card == card_face)
-        self.hand.remove(play_card)
-        return play_card
+        return self.game.state.check_stock_to_build(self.state, build_index)
 
     def play_hand_to_build(self, card_face, build_index):
-        play_card = self.get_card_from_hand(card_face)
-        build_pile = self.game.building_piles[build_index]
-        if play_card.face == 'S':
-            play_card.value = self.game.get_top_of_build_pile(build_index) + 1
-        build_pile.append(play_card)
-
-        self.game.clear_build_pile_if_full(build_index)
-
-        if len(self.hand) == 0:
-            self.fill_hand()
+        if not self.game.state.play_hand_to_build(self.state, card_face, build_index):
+            self.game.is_game_running = False
 
     def play_hand_to_discard(self, card_face, discard_index):
-        play_card = self.get_card_from_hand(card_face)
-        discard_pile = self.discard_piles[discard_index]
-        discard_pile.append(play_card)
+        self.game.state.play_hand_to_discard(self.state, card_face, discard_index)
 
     def play_discard_to_build(self, discard_index, build_index):
-        discard_pile = self.discard_piles[discard_index]
-        card = discard_pile.pop()
-
-        if card.face == 'S':
-            card.value = self.game.get_top_of_build_pile(build_index) + 1
-
-        build_pile = self.game.building_piles[build_index]
-        build_pile.append(card)
-
-        self.game.clear_build_pile_if_full(build_index)
+        self.game.state.play_discard_to_build(self.state, discard_index, build_index)
 
     def play_stock_to_build(self, build_index):
-        card = self.stock_pile.pop()
-
-        if card.face == 'S':
-            card.value = self.game.get_top_of_build_pile(build_index) + 1
-
-        build_pile = self.game.building_piles[build_index]
-        build_pile.append(card)
-
-        self.game.clear_build_pile_if_full(build_index)
+        self.game.state.play_stock_to_build(self.state, build_index)
 
     def print_game_state(self):
         # TODO: Add opponent game state (Scale up to 3 other players)
@@ -105,8 +72,8 @@ class Player(ABC):
             # There might be a better way to get the other player
             other_player = [player for player in self.game.players if player != self][0]
             print(f"{len(other_player.stock_pile)} cards left in stock pile")
-            print(f"[{other_player.stock_pile[-1]}]]  " + " ".join(
-                [f"[{other_player.discard_piles[pile_index][-1] if len(other_player.discard_piles[pile_index]) > 0 else '_'}]" for
+            print(f"[{face_to_str(other_player.stock_pile[-1])}]]  " + " ".join(
+                [f"[{face_to_str(other_player.discard_piles[pile_index][-1]) if len(other_player.discard_piles[pile_index]) > 0 else '_'}]" for
                  pile_index in range(0, 4)]))
             print()
 
@@ -115,9 +82,9 @@ class Player(ABC):
         print("  ".join([f"[{top if top > 0 else '_'}]" for top in tops_of_build_piles]))
         print()
         # Discard piles. Only show top card per pile.
-        print(f"[{self.stock_pile[-1]}]]  " + " ".join([f"[{self.discard_piles[pile_index][-1] if len(self.discard_piles[pile_index]) > 0 else '_'}]" for pile_index in range(0,4)]))
+        print(f"[{face_to_str(self.stock_pile[-1])}]]  " + " ".join([f"[{face_to_str(self.discard_piles[pile_index][-1]) if len(self.discard_piles[pile_index]) > 0 else '_'}]" for pile_index in range(0,4)]))
         print(f"{len(self.stock_pile)} cards left in stock pile")
         print('----------------------')
         # Hand and stock
-        print("=> " + " ".join([f"[{card}]" for card in self.hand]) + " <=")
+        print("=> " + " ".join([f"[{face_to_str(card)}]" for card in self.hand]) + " <=")
         print()
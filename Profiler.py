@@ -0,0 +1,95 @@
+import json
+import threading
+import time
+
+
+class PhaseTimer:
+    """
+    Adds the time spent in a with block to the totals of a phase
+    """
+    __slots__ = ("phase", "totals", "start")
+
+    def __init__(self, phase, totals):
+        self.phase = phase
+        self.totals = totals
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        totals = self.totals.get(self.phase)
+        if totals is None:
+            totals = self.totals[self.phase] = [0.0, 0]
+        totals[0] += time.perf_counter() - self.start
+        totals[1] += 1
+
+
+class Profiler:
+    """
+    Time and number of calls per phase of a game (hand refill, mask, encoding, action selection, ...), written as one
+    JSON line per episode to path.
+    Every thread has its own totals, so games played at the same time in different threads are profiled separately:
+    end_episode writes and resets the totals of the thread that calls it.
+    """
+    enabled = True
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", buffering=1)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def totals(self):
+        totals = getattr(self.local, "totals", None)
+        if totals is None:
+            totals = self.local.totals = {}
+        return totals
+
+    def phase(self, name):
+        return PhaseTimer(name, self.totals())
+
+    def end_episode(self, episode, **info):
+        """
+        info: Extra values to write with the phases, like the number of turns
+        """
+        totals = self.totals()
+        record = {"episode": episode, **info,
+                  "phases": {name: {"seconds": seconds, "count": count} for name, (seconds, count) in totals.items()}}
+        totals.clear()
+        with self.lock:
+            self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class NullProfiler:
+    """
+    Profiler that does nothing, used when profiling is disabled
+    """
+    enabled = False
+    null_phase = NullPhase()
+
+    def phase(self, name):
+        return self.null_phase
+
+    def end_episode(self, episode, **info):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,100 @@
+import argparse
+import copy
+import warnings
+
+import numpy as np
+import torch
+from torch import nn
+
+import ComputerPlayer as CP
+from VecSkipBoEnv import VecSkipBoEnv
+
+NUM_STATES = 5_000  # States recorded for the agreement check
+NUM_ENVS = 64
+NUM_STOCK_CARDS = 30
+NUM_GAMES = 1_000  # Games against RandomComputerPlayer for the win rate check
+MIN_AGREEMENT = 0.99  # Fraction of states the quantized model has to agree on to be used instead of the fp32 model
+
+
+def quantize(model):
+    """
+    Copy of a NeuralNetwork with int8 weights in its Linear layers, the activations are quantized dynamically per
+    batch. Runs on CPU only, and is fastest for batches (see Tester.test with num_threads or num_envs).
+    """
+    with warnings.catch_warnings():
+        # Eager mode quantization is deprecated in favour of torchao, which this project does not depend on
+        warnings.simplefilter("ignore")
+        return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).cpu().eval(), {nn.Linear},
+                                                      dtype=torch.qint8)
+
+
+def record_states(model, opponent_input, num_states=NUM_STATES, num_envs=NUM_ENVS, num_stock_cards=NUM_STOCK_CARDS,
+                  seed=None):
+    """
+    Model inputs and masks of num_states decisions in games where model plays against itself
+    """
+    env = VecSkipBoEnv(num_envs, num_stock_cards=num_stock_cards, opponent_input=opponent_input, seed=seed)
+    obs, mask = env.reset()
+    states, masks = [], []
+    recorded = 0
+    while recorded < num_states:
+        states.append(obs)
+        masks.append(mask)
+        recorded += len(obs)
+        actions = CP.select_actions(model, torch.from_numpy(obs), torch.from_numpy(mask)).numpy()
+        obs, mask, _, _, _ = env.step(actions)
+    return np.concatenate(states)[:num_states], np.concatenate(masks)[:num_states]
+
+
+def agreement(model, quantized, states, masks):
+    """
+    Fraction of states in which both models select the same action
+    """
+    states, masks = torch.from_numpy(states), torch.from_numpy(masks)
+    actions = CP.select_actions(model, states, masks)
+    quantized_actions = CP.select_actions(quantized, states, masks)
+    return (actions == quantized_actions).float().mean().item()
+
+
+def check_agreement(model, quantized, opponent_input, num_states=NUM_STATES, seed=None):
+    states, masks = record_states(model, opponent_input, num_states, seed=seed)
+    return agreement(model, quantized, states, masks)
+
+
+def win_rate_vs_random(model, name, num_games=NUM_GAMES, num_stock_cards=NUM_STOCK_CARDS):
+    """
+    Fraction of games model wins against a RandomComputerPlayer, name decides the player type like in CageMatch
+    """
+    from CageMatch import make_tester
+    tester = make_tester(["Random", name], ['', model], None, 2, num_stock_cards, num_games)
+    game_winners, _ = tester.test_vectorized(NUM_ENVS)
+    return game_winners[name] / num_games
+
+
+def check(model_name, num_states=NUM_STATES, num_games=NUM_GAMES, num_stock_cards=NUM_STOCK_CARDS):
+    """
+    Compares the int8 version of a saved model with the fp32 model: the fraction of recorded states in which they
+    select the same action, and their win rates against RandomComputerPlayer
+    """
+    from CageMatch import load_model
+    model = load_model(model_name, torch.device("cpu"), backend="torch")
+    quantized = quantize(model)
+    return {
+        "agreement": check_agreement(model, quantized, "opponent" in model_name, num_states),
+        "fp32_win_rate": win_rate_vs_random(model, model_name, num_games, num_stock_cards),
+        "int8_win_rate": win_rate_vs_random(quantized, model_name, num_games, num_stock_cards),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks how well int8 versions of saved models match the originals")
+    parser.add_argument("models", nargs="+", help="Model files in the models directory")
+    parser.add_argument("--states", type=int, default=NUM_STATES, help="Recorded states for the agreement check")
+    parser.add_argument("--games", type=int, default=NUM_GAMES, help="Games against Random per model version")
+    parser.add_argument("--cards", type=int, default=NUM_STOCK_CARDS, help="Stock cards per player")
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+    for model_name in args.models:
+        result = check(model_name, args.states, args.games, args.cards)
+        print(f"{model_name}: agreement {result['agreement']:.4f}, win rate vs Random "
+              f"fp32 {result['fp32_win_rate']:.3f}, int8 {result['int8_win_rate']:.3f}")
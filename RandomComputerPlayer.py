@@ -1,9 +1,9 @@
-import torch
-
 from ComputerPlayer import ComputerPlayer
 
 
 class RandomComputerPlayer(ComputerPlayer):
+    uses_model = False
+
     def select_action(self, training, verbose, steps_done):
-        action = torch.multinomial(self.mask, 1).item()
-        return action
+        action = self.rng.choice(self.mask_engine.legal_actions())
+        return int(action)
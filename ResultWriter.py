@@ -0,0 +1,122 @@
+import csv
+import os
+
+ACTION_COLUMNS = ["Player 1", "Player 2", "Game Number", "Turns", "Player 1 Actions Count", "Player 2 Actions Count",
+                  "Winner"]
+NAME_COLUMNS = {"Player 1", "Player 2", "Winner"}
+FLUSH_EVERY = 100  # Games buffered before they are written
+
+
+class ResultWriter:
+    """
+    Writes the games of a CageMatch while it runs: every game is a row of the actions file, and the win matrix is
+    derived from those rows and rewritten on every flush. A tournament therefore only keeps the buffered rows and the
+    win counts in memory, and its results so far can be read at any time.
+    Rows are written as csv, or as parquet row groups with parquet=True (needs pyarrow).
+    """
+
+    def __init__(self, prefix, names, flush_every=FLUSH_EVERY, parquet=False):
+        """
+        prefix: Path the file names are made from, prefix_actions.csv (or .parquet) and prefix_win.csv
+        names: Order of the rows and columns of the win matrix
+        """
+        self.names = list(names)
+        self.flush_every = flush_every
+        self.win_path = prefix + "_win.csv"
+        self.actions_path = prefix + ("_actions.parquet" if parquet else "_actions.csv")
+        self.wins = {}
+        self.buffer = []
+        self.num_games = 0
+        if parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self.schema = pa.schema([(column, pa.string() if column in NAME_COLUMNS else pa.int64())
+                                     for column in ACTION_COLUMNS])
+            self.parquet_writer = pq.ParquetWriter(self.actions_path, self.schema)
+            self.file = None
+        else:
+            self.parquet_writer = None
+            self.file = open(self.actions_path, "w", newline="")
+            self.csv_writer = csv.writer(self.file)
+            self.csv_writer.writerow(ACTION_COLUMNS)
+
+    def add_games(self, rows):
+        """
+        rows: Rows of ACTION_COLUMNS, as returned by Tester.test
+        """
+        for row in rows:
+            count_win(self.wins, row)
+        self.buffer += rows
+        self.num_games += len(rows)
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.parquet_writer is not None:
+            if self.buffer:
+                import pyarrow as pa
+                columns = list(zip(*self.buffer))
+                self.parquet_writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+                    schema=self.schema))
+        else:
+            self.csv_writer.writerows(self.buffer)
+            self.file.flush()
+        self.buffer.clear()
+        write_win_matrix(self.win_path, self.names, self.wins)
+
+    def close(self):
+        self.flush()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        else:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def count_win(wins, row):
+    """
+    Adds the game of a row of ACTION_COLUMNS to wins, which maps (player, opponent) to the games player won
+    """
+    player_1, player_2, winner = row[0], row[1], row[-1]
+    wins.setdefault((player_1, player_2), 0)
+    wins.setdefault((player_2, player_1), 0)
+    if winner == player_1:
+        wins[player_1, player_2] += 1
+    elif winner == player_2:
+        wins[player_2, player_1] += 1
+
+
+def write_win_matrix(path, names, wins):
+    """
+    Writes the games the model of every row won against the model of every column, empty for matchups without games.
+    The header holds names, the rows follow in the same order without an index column.
+    """
+    with open(path + ".tmp", "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(names)
+        writer.writerows([wins.get((player, opponent), "") for opponent in names] for player in names)
+    os.replace(path + ".tmp", path)
+
+
+def read_wins(actions_path):
+    """
+    Win counts of an actions file written by a ResultWriter, also of a tournament that is still running or crashed
+    """
+    wins = {}
+    if actions_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for row in zip(*pq.read_table(actions_path).to_pydict().values()):
+            count_win(wins, row)
+    else:
+        with open(actions_path, newline="") as file:
+            rows = csv.reader(file)
+            next(rows)
+            for row in rows:
+                count_win(wins, row)
+    return wins
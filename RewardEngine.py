@@ -0,0 +1,123 @@
+import numpy as np
+
+from ActionSpace import (KIND_DISCARD_TO_BUILD, KIND_HAND_TO_BUILD, KIND_HAND_TO_DISCARD, KIND_STOCK_TO_BUILD, KINDS,
+                         NUM_ACTIONS)
+import ComputerPlayer as CP
+
+# Events a reward can be given for, in the order of the last axis of event arrays
+EVENTS = ("stock", "discard", "win", "loss", "hand_to_build", "discard_to_build")
+STOCK, DISCARD, WIN, LOSS, HAND_TO_BUILD, DISCARD_TO_BUILD = range(len(EVENTS))
+NUM_EVENTS = len(EVENTS)
+
+# Events of every action, apart from win and loss which depend on the rest of the game
+ACTION_EVENTS = np.zeros((NUM_ACTIONS, NUM_EVENTS), dtype=np.float32)
+ACTION_EVENTS[KINDS == KIND_HAND_TO_BUILD, HAND_TO_BUILD] = 1
+ACTION_EVENTS[KINDS == KIND_HAND_TO_DISCARD, DISCARD] = 1
+ACTION_EVENTS[KINDS == KIND_DISCARD_TO_BUILD, DISCARD_TO_BUILD] = 1
+ACTION_EVENTS[KINDS == KIND_STOCK_TO_BUILD, STOCK] = 1
+
+
+def action_events(actions, won=None, lost=None):
+    """
+    Events of an array of actions, of shape actions.shape + (NUM_EVENTS,)
+    won, lost: Whether the action won the game, and whether the game was lost after the action, broadcast to actions
+    """
+    events = ACTION_EVENTS[actions]
+    if won is not None:
+        events[..., WIN] = won
+    if lost is not None:
+        events[..., LOSS] = lost
+    return events
+
+
+class RewardSpec:
+    """
+    A reward as a weight per event of EVENTS, the reward of a transition is the weighted sum of its events.
+    name: Name of the models trained with it, ComputerPlayer.__str__ returns it
+    """
+
+    def __init__(self, name, **weights):
+        unknown = set(weights) - set(EVENTS)
+        if unknown:
+            raise ValueError(f"Unknown reward events {sorted(unknown)}, expected some of {EVENTS}")
+        self.name = name
+        self.weights = weights
+        self.vector = np.array([weights.get(event, 0) for event in EVENTS], dtype=np.float32)
+        self.win_reward = weights.get("win", 0)
+        self.loss_reward = weights.get("loss", 0)
+        # Reward of every action if it does not win, as Python numbers for ComputerPlayer.do_action
+        self.action_rewards = [sum(weights.get(event, 0) * count for event, count in zip(EVENTS, events))
+                               for events in ACTION_EVENTS.tolist()]
+
+    def reward(self, action, won=False):
+        return self.action_rewards[action] + self.win_reward if won else self.action_rewards[action]
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return f"RewardSpec({self.name!r}, {self.weights})"
+
+
+class RewardEngine:
+    """
+    Rewards of batches of transitions for one or more RewardSpecs at once, from the same event arrays
+    """
+
+    def __init__(self, specs):
+        self.specs = list(specs)
+        self.weights = np.stack([spec.vector for spec in self.specs], axis=1)  # (NUM_EVENTS, number of specs)
+        self.device_weights = {}  # Copy of weights per torch device
+
+    def rewards(self, events):
+        """
+        events: NumPy array or torch tensor of shape (..., NUM_EVENTS), see action_events
+        Returns the rewards of shape (..., number of specs), of the same type as events
+        """
+        if isinstance(events, np.ndarray):
+            return events.astype(np.float32, copy=False) @ self.weights
+        weights = self.device_weights.get(events.device)
+        if weights is None:
+            import torch
+            weights = self.device_weights[events.device] = torch.from_numpy(self.weights).to(events.device)
+        return events.to(weights.dtype) @ weights
+
+
+# The reward strategies models were trained with, by the name of their models
+PRESETS = {spec.name: spec for spec in [
+    RewardSpec("win_only_computer_player", win=CP.WIN_REWARD),
+    RewardSpec("loss_only_computer_player", loss=CP.LOSS_REWARD),
+    RewardSpec("discard_stock_computer_player", discard=CP.DISCARD_REWARD, stock=CP.STOCK_REWARD),
+    RewardSpec("win_stock_computer_player", stock=CP.STOCK_REWARD, win=CP.WIN_REWARD),
+    RewardSpec("punish_computer_player", discard=CP.DISCARD_REWARD, loss=CP.LOSS_REWARD),
+    RewardSpec("discard_computer_player", discard=CP.DISCARD_REWARD),
+    RewardSpec("discard_win_computer_player", discard=CP.DISCARD_REWARD, win=CP.WIN_REWARD),
+    RewardSpec("everything_computer_player", discard=CP.DISCARD_REWARD, stock=CP.STOCK_REWARD, win=CP.WIN_REWARD,
+               loss=CP.LOSS_REWARD),
+    RewardSpec("stock_computer_player", stock=CP.STOCK_REWARD),
+    RewardSpec("win_loss_computer_player", win=CP.WIN_REWARD, loss=CP.LOSS_REWARD),
+    RewardSpec("complex_computer_player", discard=CP.DISCARD_REWARD, stock=CP.STOCK_REWARD, win=CP.WIN_REWARD),
+]}
+WIN_ONLY = PRESETS["win_only_computer_player"]
+
+# Names of the reward strategy classes the presets replace, as in older Sweep configurations
+STRATEGY_NAMES = {
+    "WinOnlyRewardStrategy": "win_only_computer_player",
+    "LossOnlyRewardStrategy": "loss_only_computer_player",
+    "DiscardStockRewardStrategy": "discard_stock_computer_player",
+    "WinStockRewardStrategy": "win_stock_computer_player",
+    "PunishRewardStrategy": "punish_computer_player",
+    "DiscardRewardStrategy": "discard_computer_player",
+    "DiscardWinRewardStrategy": "discard_win_computer_player",
+    "EverythingRewardStrategy": "everything_computer_player",
+    "StockRewardStrategy": "stock_computer_player",
+    "WinLossRewardStrategy": "win_loss_computer_player",
+    "ComplexRewardStrategy": "complex_computer_player",
+}
+
+
+def preset(name):
+    """
+    RewardSpec of a preset, by its name or by the name of the reward strategy class it replaces
+    """
+    return PRESETS[STRATEGY_NAMES.get(name, name)]
@@ -0,0 +1,75 @@
+import numpy as np
+
+NUM_PILES = 4
+
+# Offsets of the parts of the model input, see ComputerPlayer.model_input and OpponentComputerPlayer.model_input
+DISCARD_OFFSET = 13
+STOCK_OFFSET = 13 + 13 * 4
+BUILD_OFFSET = 13 + 13 * 4 + 13
+STOCK_COUNT_OFFSET = 13 + 13 * 4 + 13 + 12 * 4
+OPPONENT_OFFSET = STOCK_COUNT_OFFSET + 1
+OPPONENT_STOCK_OFFSET = OPPONENT_OFFSET + 13 * 4
+OPPONENT_STOCK_COUNT_OFFSET = OPPONENT_STOCK_OFFSET + 13
+DIM_IN = OPPONENT_OFFSET
+DIM_IN_OPPONENT = OPPONENT_STOCK_COUNT_OFFSET + 1
+
+
+class StateEncoder:
+    """
+    Keeps the model input of a player up to date in a NumPy buffer.
+    Every one hot encoding remembers which slot it has set, so an update only clears and sets the slots that changed.
+    The opponent part (if with_opponent is set) can not change during a turn, so it is only encoded by start_turn.
+    """
+
+    def __init__(self, player, with_opponent=False):
+        self.player = player
+        self.with_opponent = with_opponent
+        self.buffer = np.zeros(DIM_IN_OPPONENT if with_opponent else DIM_IN, dtype=np.float32)
+        self.hand_counts = None
+        # Slot in self.buffer that is set per one hot encoding, None if no slot is set
+        self.discard_slots = [None] * NUM_PILES
+        self.stock_slot = [None]
+        self.build_slots = [None] * NUM_PILES
+        self.opponent_discard_slots = [None] * NUM_PILES
+        self.opponent_stock_slot = [None]
+
+    def _set_slot(self, slots, index, slot):
+        old_slot = slots[index]
+        if old_slot != slot:
+            if old_slot is not None:
+                self.buffer[old_slot] = 0
+            if slot is not None:
+                self.buffer[slot] = 1
+            slots[index] = slot
+
+    def _encode_piles(self, player_state, discard_slots, stock_slot, discard_offset, stock_offset,
+                      stock_count_offset):
+        for discard_index, discard_pile in enumerate(player_state.discard_piles):
+            slot = discard_offset + 13 * discard_index + discard_pile[-1] - 1 if len(discard_pile) > 0 else None
+            self._set_slot(discard_slots, discard_index, slot)
+        stock_pile = player_state.stock_pile
+        self._set_slot(stock_slot, 0, stock_offset + stock_pile[-1] - 1 if len(stock_pile) > 0 else None)
+        self.buffer[stock_count_offset] = len(stock_pile)
+
+    def start_turn(self):
+        if not self.with_opponent:
+            return
+        players = self.player.game.players
+        opponent = players[0] if players[0] != self.player else players[1]
+        self._encode_piles(opponent.state, self.opponent_discard_slots, self.opponent_stock_slot, OPPONENT_OFFSET,
+                           OPPONENT_STOCK_OFFSET, OPPONENT_STOCK_COUNT_OFFSET)
+
+    def encode(self):
+        player_state = self.player.state
+        if self.hand_counts is None:
+            # View on the hand histogram of the player, without the unused index 0
+            self.hand_counts = np.frombuffer(player_state.hand_counts, dtype=np.uint8)[1:]
+        self.buffer[:13] = self.hand_counts
+
+        self._encode_piles(player_state, self.discard_slots, self.stock_slot, DISCARD_OFFSET, STOCK_OFFSET,
+                           STOCK_COUNT_OFFSET)
+
+        build_tops = self.player.game.state.build_tops
+        for build_index in range(NUM_PILES):
+            self._set_slot(self.build_slots, build_index, BUILD_OFFSET + 12 * build_index + build_tops[build_index])
+        return self.buffer
@@ -0,0 +1,157 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import time
+
+import pandas as pd
+import torch
+
+import ComputerPlayer as CP
+import OpponentComputerPlayer as OCP
+from RewardEngine import PRESETS, preset
+import Trainer
+
+COMPUTER_TYPES = {
+    "ComputerPlayer": CP.ComputerPlayer,
+    "OpponentComputerPlayer": OCP.OpponentComputerPlayer,
+}
+REWARD_STRATEGIES = list(PRESETS)
+MODEL_DIR = "models"
+MANIFEST_NAME = "sweep_manifest.json"
+SUMMARY_NAME = "sweep_summary.csv"
+
+
+def default_configurations():
+    """
+    The grid of Trainer's __main__: every computer type with every reward strategy
+    """
+    return [{"computer_type": computer_type, "reward_strategy": strategy}
+            for computer_type in ["OpponentComputerPlayer", "ComputerPlayer"] for strategy in REWARD_STRATEGIES]
+
+
+def make_trainer(config, device):
+    """
+    config: Dictionary with the name of the computer_type (see COMPUTER_TYPES), the name of the reward_strategy preset
+            (see RewardEngine.preset), and optionally the keyword arguments of the Trainer in trainer_args, of
+            Trainer.train in train_args, and the name of the run in name (see run_name)
+    """
+    strategy = preset(config["reward_strategy"])
+    return Trainer.Trainer(COMPUTER_TYPES[config["computer_type"]], strategy, device, name=run_name(config),
+                           **config.get("trainer_args", {}))
+
+
+def run_name(config):
+    """
+    Name of the run and its saved models: the name of the configuration if it has one, otherwise the model name of the
+    Trainer followed by the trainer_args, so runs that only differ in those get different names
+    """
+    if "name" in config:
+        return config["name"]
+    name = Trainer.model_name(COMPUTER_TYPES[config["computer_type"]], preset(config["reward_strategy"]))
+    return name + "".join(f"_{key}-{value}" for key, value in sorted(config.get("trainer_args", {}).items()))
+
+
+def latest_saved_episode(name):
+    """
+    Episode of the last policy net saved by a run, 0 if it saved none
+    """
+    pattern = re.compile(rf"exploit_{re.escape(name)}_([0-9]+)\.pth")
+    episodes = [int(match[1]) for match in map(pattern.fullmatch, os.listdir(MODEL_DIR)) if match is not None]
+    return max(episodes, default=0)
+
+
+def run_configuration(config, name, start_episode, num_threads):
+    """
+    Trains one configuration in a worker process. Continues from the checkpoint of the run if there is one, otherwise
+    from the policy net saved at start_episode if that is not 0.
+    Returns the wall-clock time in seconds and the number of games played.
+    """
+    torch.set_num_threads(num_threads)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    trainer = make_trainer(config, device)
+    resume = os.path.exists(trainer.checkpoint_path())
+    if start_episode > 0 and not resume:
+        state_dict = torch.load(os.path.join(MODEL_DIR, f"exploit_{name}_{start_episode}.pth"), weights_only=True,
+                                map_location=device)
+        trainer.policy_net.load_state_dict(state_dict)
+        trainer.target_net.load_state_dict(state_dict)
+    start = time.time()
+    games = trainer.train(start_episode=start_episode, resume=resume, **config.get("train_args", {}))
+    return time.time() - start, games
+
+
+def write_json(path, data):
+    # Write to a temporary file first, so an interrupted sweep never leaves a half written manifest
+    with open(path + ".tmp", "w") as file:
+        json.dump(data, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def run_sweep(configs, num_workers=None, num_threads=1):
+    """
+    Trains every configuration (see make_trainer) in a pool of num_workers processes, each using num_threads torch
+    threads. Finished runs are recorded in the manifest in MODEL_DIR: running the sweep again skips them, and
+    continues unfinished runs from their checkpoint (see Trainer.save_checkpoint) or their last saved policy net.
+    Writes the wall-clock time and games/sec of every run to the summary csv in MODEL_DIR.
+    """
+    if num_workers is None:
+        num_workers = max(1, (os.cpu_count() or 1) // num_threads)
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    manifest_path = os.path.join(MODEL_DIR, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+
+    names = [run_name(config) for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError("Every configuration of a sweep needs a different model name, set name in the configurations "
+                         "that share one")
+
+    with ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        runs = {}
+        for config, name in zip(configs, names):
+            if manifest.get(name, {}).get("status") == "done":
+                print(f"Skipping {name}, it already finished")
+                continue
+            start_episode = latest_saved_episode(name)
+            if start_episode > 0:
+                print(f"Continuing {name}, saved episode {start_episode}")
+            run = pool.submit(run_configuration, config, name, start_episode, num_threads)
+            runs[run] = (config, name)
+
+        for run in as_completed(runs):
+            config, name = runs[run]
+            try:
+                wall_time, games = run.result()
+            except Exception as e:
+                print(f"Run {name} failed: {e!r}")
+                manifest[name] = {"config": config, "status": "failed", "error": repr(e)}
+            else:
+                manifest[name] = {"config": config, "status": "done", "games": games, "wall_time": wall_time,
+                                  "games_per_sec": games / wall_time}
+            write_json(manifest_path, manifest)
+
+    summary = pd.DataFrame([{"name": name, "computer_type": run["config"]["computer_type"],
+                             "reward_strategy": run["config"]["reward_strategy"], "status": run["status"],
+                             "games": run.get("games"), "wall_time": run.get("wall_time"),
+                             "games_per_sec": run.get("games_per_sec")} for name, run in manifest.items()])
+    summary.to_csv(os.path.join(MODEL_DIR, SUMMARY_NAME), index=False)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trains a grid of Trainer configurations in parallel")
+    parser.add_argument("--configs", help="JSON file with a list of configurations, instead of the default grid")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--threads", type=int, default=1, help="Torch threads per worker process")
+    args = parser.parse_args()
+    if args.configs is None:
+        configs = default_configurations()
+    else:
+        with open(args.configs) as file:
+            configs = json.load(file)
+    print(run_sweep(configs, args.workers, args.threads))
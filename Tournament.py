@@ -0,0 +1,157 @@
+import itertools
+import math
+
+import numpy as np
+
+BATCH_GAMES = 20  # Games played per pairing before the ratings are updated and the next pairing is picked
+ELO_MARGIN = 30  # SPRT tests a pairing for an Elo difference of -ELO_MARGIN against +ELO_MARGIN
+SPRT_ALPHA = 0.05
+SPRT_BETA = 0.05
+CONFIDENCE_Z = 1.96  # 95% confidence intervals
+PRIOR_DRAWS = 1  # Virtual drawn games per played pairing, keeps ratings finite when a model never wins
+MM_ITERATIONS = 1000
+MM_TOLERANCE = 1e-9
+ELO_SCALE = 400 / math.log(10)
+
+
+def fit_ratings(wins, anchor=0):
+    """
+    Maximum likelihood Bradley-Terry ratings on the Elo scale, relative to the model at index anchor.
+    wins: wins[i, j] is the number of games i won against j, a draw counts as half a win for both
+    Returns the ratings and their covariance matrix (the anchor has rating and variance 0).
+    """
+    games = wins + wins.T
+    played = games > 0
+    wins = wins + PRIOR_DRAWS / 2 * played
+    games = games + PRIOR_DRAWS * played
+    total_wins = wins.sum(1)
+    # Minorization-maximization (Hunter, 2004)
+    strength = np.ones(len(wins))
+    for _ in range(MM_ITERATIONS):
+        denominator = (games / (strength[:, np.newaxis] + strength[np.newaxis, :])).sum(1)
+        new_strength = np.divide(total_wins, denominator, out=np.ones_like(strength), where=denominator > 0)
+        new_strength /= new_strength[anchor]
+        converged = np.abs(new_strength - strength).max() < MM_TOLERANCE
+        strength = new_strength
+        if converged:
+            break
+    theta = np.log(strength)
+
+    # Covariance from the inverse of the Fisher information, with the anchor fixed
+    expected = 1 / (1 + np.exp(theta[np.newaxis, :] - theta[:, np.newaxis]))
+    information = -games * expected * (1 - expected)
+    np.fill_diagonal(information, 0)
+    np.fill_diagonal(information, -information.sum(1))
+    free = np.arange(len(wins)) != anchor
+    covariance = np.zeros_like(information)
+    covariance[np.ix_(free, free)] = np.linalg.pinv(information[np.ix_(free, free)])
+    # Models not connected to the anchor by played games have no rating yet
+    unrated = free & (np.diag(covariance) <= 0)
+    covariance[unrated, unrated] = np.inf
+    return ELO_SCALE * theta, ELO_SCALE ** 2 * covariance
+
+
+def sprt_llr(wins, losses, elo_margin=ELO_MARGIN):
+    """
+    Log likelihood ratio of an Elo difference of +elo_margin against -elo_margin, draws carry no information
+    """
+    p1 = 1 / (1 + 10 ** (-elo_margin / 400))
+    return (wins - losses) * math.log(p1 / (1 - p1))
+
+
+def sprt_bounds(alpha=SPRT_ALPHA, beta=SPRT_BETA):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+class Tournament:
+    """
+    Adaptive replacement of a round robin: keeps Bradley-Terry ratings of the models, and picks the pairing whose next
+    games are expected to tell the most about the ranking. A pairing is finished when a sequential probability ratio
+    test (SPRT) decides which of the two is better, when the ratings already separate the two with confidence, or when
+    it played max_games games.
+    The first model is the anchor of the ratings (Random in CageMatch), and every other model plays it first.
+    """
+
+    def __init__(self, names, max_games, batch_games=BATCH_GAMES):
+        self.names = list(names)
+        self.max_games = max_games
+        self.batch_games = batch_games
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.wins = np.zeros((len(self.names), len(self.names)))
+        self.games = np.zeros((len(self.names), len(self.names)), dtype=int)
+        self.decided = set()
+        self.ratings = np.zeros(len(self.names))
+        self.covariance = np.full((len(self.names), len(self.names)), np.inf)
+        self.covariance[0, 0] = 0
+
+    def record(self, names, game_winners):
+        """
+        Adds the results of games between the two models in names, game_winners as returned by Tester.test
+        """
+        i, j = self.index[names[0]], self.index[names[1]]
+        draws = game_winners["lost"]
+        self.wins[i, j] += game_winners[names[0]] + draws / 2
+        self.wins[j, i] += game_winners[names[1]] + draws / 2
+        played = game_winners[names[0]] + game_winners[names[1]] + draws
+        self.games[i, j] += played
+        self.games[j, i] += played
+        self.ratings, self.covariance = fit_ratings(self.wins)
+
+        lower, upper = sprt_bounds()
+        # The half wins of draws cancel out in the likelihood ratio
+        llr = sprt_llr(self.wins[i, j], self.wins[j, i])
+        if not lower < llr < upper:
+            self.decided.add((min(i, j), max(i, j)))
+
+    def separated(self, i, j):
+        variance = self.covariance[i, i] + self.covariance[j, j] - 2 * self.covariance[i, j]
+        return abs(self.ratings[i] - self.ratings[j]) > CONFIDENCE_Z * math.sqrt(variance)
+
+    def information(self, i, j):
+        """
+        Expected reduction of the variance of the rating difference of i and j by one more game between them
+        """
+        variance = self.covariance[i, i] + self.covariance[j, j] - 2 * self.covariance[i, j]
+        expected = 1 / (1 + 10 ** ((self.ratings[j] - self.ratings[i]) / 400))
+        fisher = expected * (1 - expected) / ELO_SCALE ** 2
+        return variance ** 2 * fisher / (1 + variance * fisher)
+
+    def next_pairing(self):
+        """
+        Names of the next two models to play, None when the tournament is finished
+        """
+        for i in range(1, len(self.names)):
+            if self.games[0, i] == 0:
+                return [self.names[0], self.names[i]]
+        best, best_information = None, 0.0
+        for i, j in itertools.combinations(range(len(self.names)), 2):
+            if (i, j) in self.decided or self.games[i, j] >= self.max_games:
+                continue
+            if self.separated(i, j):
+                continue
+            information = self.information(i, j)
+            if information > best_information:
+                best, best_information = (i, j), information
+        return None if best is None else [self.names[best[0]], self.names[best[1]]]
+
+    def games_played(self, names):
+        return int(self.games[self.index[names[0]], self.index[names[1]]])
+
+    def games_for(self, names):
+        """
+        Number of games to play in the next batch of a pairing
+        """
+        return min(self.batch_games, self.max_games - self.games_played(names))
+
+    def leaderboard(self):
+        """
+        Rows of name, Elo rating with its confidence interval and number of games, best model first
+        """
+        errors = CONFIDENCE_Z * np.sqrt(np.diag(self.covariance))
+        rows = [{"name": name, "elo": float(self.ratings[i]), "elo_low": float(self.ratings[i] - errors[i]),
+                 "elo_high": float(self.ratings[i] + errors[i]), "games": int(self.games[i].sum())}
+                for i, name in enumerate(self.names)]
+        rows.sort(key=lambda row: -row["elo"])
+        for rank, row in enumerate(rows, 1):
+            row["rank"] = rank
+        return rows
@@ -1,6 +1,9 @@
-from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
 import random
+import threading
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -8,18 +11,12 @@ from tqdm.auto import tqdm
 
 import ComputerPlayer as CP
 from Game import Game
+from ActorPool import ActorPool
+from InferenceServer import InferenceServer
 import OpponentComputerPlayer as OCP
-from reward_strategies.LossOnlyRewardStrategy import LossOnlyRewardStrategy
-from reward_strategies.PunishRewardStrategy import PunishRewardStrategy
-from reward_strategies.WinLossRewardStrategy import WinLossRewardStrategy
-from reward_strategies.WinOnlyRewardStrategy import WinOnlyRewardStrategy
-from reward_strategies.StockRewardStrategy import StockRewardStrategy
-from reward_strategies.WinStockRewardStrategy import WinStockRewardStrategy
-from reward_strategies.DiscardRewardStrategy import DiscardRewardStrategy
-from reward_strategies.DiscardStockRewardStrategy import DiscardStockRewardStrategy
-from reward_strategies.DiscardWinRewardStrategy import DiscardWinRewardStrategy
-from reward_strategies.ComplexRewardStrategy import ComplexRewardStrategy
-from reward_strategies.EverythingRewardStrategy import EverythingRewardStrategy
+from Profiler import NULL_PROFILER, Profiler
+from RewardEngine import PRESETS
+from VecSkipBoEnv import TransitionTracker, VecSkipBoEnv
 
 BATCH_SIZE = 128
 GAMMA = 0.99
@@ -27,6 +24,21 @@ TAU = 0.005
 NUM_GAMES = 10_000
 MAX_NUM_CARDS = 30
 NUM_COMPUTER_PLAYERS = 2
+MEMORY_CAPACITY = 10_000
+# Prioritized experience replay, see PrioritizedReplayMemory
+PRIORITY_ALPHA = 0.6
+PRIORITY_BETA_START = 0.4
+PRIORITY_BETA_STEPS = 100_000
+PRIORITY_EPSILON = 1e-3
+PUBLISH_INTERVAL = 10  # Learner steps between sharing the policy weights with the actors of train_distributed
+# Learner schedule, see Trainer.learn
+TRAIN_EVERY = 1  # Environment steps between learner steps, None for a learner step after every step of the loop
+UPDATES_PER_STEP = 1  # Gradient steps per learner step
+TARGET_UPDATE = "soft"  # "soft" blends the target net towards the policy net with TAU, "hard" copies it
+TARGET_UPDATE_INTERVAL = 1  # Gradient steps between target net updates
+TARGET_UPDATES = ("soft", "hard")
+CHECKPOINT_DIR = "checkpoints"
+CHECKPOINT_INTERVAL = 100  # Games between checkpoints
 
 
 class Experience(object):
@@ -39,27 +51,210 @@ class Experience(object):
 
 
 class ReplayMemory(object):
-    def __init__(self, capacity):
-        self.memory = deque(maxlen=capacity)
+    """
+    Ring buffer of experiences stored in preallocated tensors, the oldest experience is overwritten once it is full
+    """
+    def __init__(self, capacity, dim_in, dim_out, device):
+        self.capacity = capacity
+        self.states = torch.zeros((capacity, dim_in), device=device)
+        self.actions = torch.zeros(capacity, dtype=torch.long, device=device)
+        self.rewards = torch.zeros(capacity, device=device)
+        self.next_states = torch.zeros((capacity, dim_in), device=device)
+        self.next_masks = torch.zeros((capacity, dim_out), device=device)
+        self.dones = torch.zeros(capacity, dtype=torch.bool, device=device)
+        self.position = 0  # Index the next experience is written to
+        self.size = 0
 
     def add(self, experience):
-        self.memory.append(experience)
+        index = self.position
+        self.states[index] = experience.state
+        self.actions[index] = experience.action
+        self.rewards[index] = experience.reward
+        self.dones[index] = experience.next_state is None
+        if experience.next_state is not None:
+            self.next_states[index] = experience.next_state
+            self.next_masks[index] = experience.next_mask
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def add_batch(self, states, actions, rewards, next_states, next_masks, dones):
+        """
+        Adds a batch of experiences at once, all arguments are tensors with the experiences along the first dimension
+        """
+        count = min(len(actions), self.capacity)
+        indices = (self.position + torch.arange(count, device=self.states.device)) % self.capacity
+        self.states[indices] = states[-count:]
+        self.actions[indices] = actions[-count:]
+        self.rewards[indices] = rewards[-count:]
+        self.next_states[indices] = next_states[-count:]
+        self.next_masks[indices] = next_masks[-count:]
+        self.dones[indices] = dones[-count:]
+        self.position = (self.position + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+
+    def sample_indices(self, batch_size):
+        return torch.randint(self.size, (batch_size,), device=self.states.device)
 
     def sample(self, batch_size):
-        batch = random.sample(self.memory, batch_size)
-        return batch
+        """
+        Returns (indices, states, actions, rewards, next_states, next_masks, dones, weights) of a sampled batch.
+        weights are the importance sampling weights of the experiences, None as every experience is equally likely.
+        """
+        indices = self.sample_indices(batch_size)
+        return (indices, self.states[indices], self.actions[indices], self.rewards[indices],
+                self.next_states[indices], self.next_masks[indices], self.dones[indices], None)
+
+    def update_priorities(self, indices, td_errors):
+        pass
+
+    def state_dict(self):
+        return {"states": self.states, "actions": self.actions, "rewards": self.rewards,
+                "next_states": self.next_states, "next_masks": self.next_masks, "dones": self.dones,
+                "position": self.position, "size": self.size}
+
+    def load_state_dict(self, state_dict):
+        for name in ["states", "actions", "rewards", "next_states", "next_masks", "dones"]:
+            getattr(self, name).copy_(state_dict[name])
+        self.position = state_dict["position"]
+        self.size = state_dict["size"]
 
     def __len__(self):
-        return len(self.memory)
+        return self.size
+
+
+class SumTree(object):
+    """
+    Binary tree in a flat array where every node holds the sum of its two children.
+    The root is at index 1, leaf i at index leaf_count + i, with leaf_count the capacity rounded up to a power of two.
+    """
+    def __init__(self, capacity):
+        self.leaf_count = 1 << (capacity - 1).bit_length()
+        self.nodes = np.zeros(2 * self.leaf_count, dtype=np.float64)
+
+    def total(self):
+        return self.nodes[1]
+
+    def get(self, indices):
+        return self.nodes[indices + self.leaf_count]
+
+    def update(self, indices, values):
+        nodes = indices + self.leaf_count
+        self.nodes[nodes] = values
+        # Recompute the sums from the children, so duplicate indices and rounding errors can not build up
+        nodes = np.unique(nodes // 2)
+        while nodes[0] > 0:
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values):
+        """
+        Index of the leaf in which every prefix sum of values falls, walking down from the root in O(log n)
+        """
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.leaf_count:
+            left = 2 * nodes
+            go_right = (values >= self.nodes[left]) & (self.nodes[left + 1] > 0)
+            values = np.where(go_right, values - self.nodes[left], values)
+            nodes = np.where(go_right, left + 1, left)
+        return nodes - self.leaf_count
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+    """
+    Samples experiences with probability proportional to priority ** alpha, where the priority is the absolute TD error
+    of the last time the experience was sampled. New experiences get the highest priority seen so far.
+    The importance sampling exponent beta grows from PRIORITY_BETA_START to 1 over PRIORITY_BETA_STEPS batches.
+    """
+    def __init__(self, capacity, dim_in, dim_out, device, alpha=PRIORITY_ALPHA, beta=PRIORITY_BETA_START):
+        super().__init__(capacity, dim_in, dim_out, device)
+        self.tree = SumTree(capacity)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = (1 - beta) / PRIORITY_BETA_STEPS
+        self.max_priority = 1.0
+        self.rng = np.random.default_rng()
+
+    def add(self, experience):
+        self.tree.update(np.array([self.position]), self.max_priority ** self.alpha)
+        super().add(experience)
+
+    def add_batch(self, states, actions, rewards, next_states, next_masks, dones):
+        count = min(len(actions), self.capacity)
+        self.tree.update((self.position + np.arange(count)) % self.capacity, self.max_priority ** self.alpha)
+        super().add_batch(states, actions, rewards, next_states, next_masks, dones)
+
+    def sample_indices(self, batch_size):
+        # Stratified sampling, one experience out of every equally sized slice of the total priority
+        segment = self.tree.total() / batch_size
+        values = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+        return np.minimum(self.tree.find(values), self.size - 1)
+
+    def sample(self, batch_size):
+        indices = self.sample_indices(batch_size)
+        probabilities = self.tree.get(indices) / self.tree.total()
+        weights = (self.size * probabilities) ** -self.beta
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        weights = torch.tensor(weights / weights.max(), dtype=torch.float, device=self.states.device)
+        indices = torch.from_numpy(indices).to(self.states.device)
+        return (indices, self.states[indices], self.actions[indices], self.rewards[indices],
+                self.next_states[indices], self.next_masks[indices], self.dones[indices], weights)
+
+    def update_priorities(self, indices, td_errors):
+        priorities = td_errors.cpu().numpy().astype(np.float64) + PRIORITY_EPSILON
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(indices.cpu().numpy(), priorities ** self.alpha)
+
+    def state_dict(self):
+        state_dict = super().state_dict()
+        state_dict.update(tree=self.tree.nodes, beta=self.beta, max_priority=self.max_priority,
+                          rng=self.rng.bit_generator.state)
+        return state_dict
+
+    def load_state_dict(self, state_dict):
+        super().load_state_dict(state_dict)
+        self.tree.nodes[:] = state_dict["tree"]
+        self.beta = state_dict["beta"]
+        self.max_priority = state_dict["max_priority"]
+        self.rng.bit_generator.state = state_dict["rng"]
+
+
+def model_name(computer_type, reward_strategy):
+    """
+    Name of the models of a Trainer, the same as str() of the players that are trained
+    """
+    name = reward_strategy.name
+    return f"opponent_{name}" if computer_type == OCP.OpponentComputerPlayer else name
 
 
 class Trainer:
     # Based on https://pytorch.org/tutorials/intermediate/reinforcement_q_learning.html
-    def __init__(self, computer_type, reward_strategy, device):
+    def __init__(self, computer_type, reward_strategy, device, memory_capacity=MEMORY_CAPACITY, prioritized=False,
+                 train_every=TRAIN_EVERY, updates_per_step=UPDATES_PER_STEP, target_update=TARGET_UPDATE,
+                 target_update_interval=TARGET_UPDATE_INTERVAL, checkpoint_interval=CHECKPOINT_INTERVAL,
+                 profile=False, name=None):
+        """
+        :param prioritized: Use prioritized experience replay instead of sampling experiences uniformly
+        :param train_every: Environment steps (actions) between learner steps. The default of 1 keeps the replay ratio
+                            of train in every training mode. None does a learner step after every step of the
+                            training loop: every action in train, but only every batch of actions in
+                            train_vectorized and every actor message in train_distributed.
+        :param updates_per_step: Gradient steps per learner step
+        :param target_update: "soft" for a Polyak update with TAU, "hard" to copy the policy net
+        :param target_update_interval: Gradient steps between target net updates
+        :param checkpoint_interval: Games between saving everything needed to resume training, see save_checkpoint
+        :param profile: Write the time spent per phase of every episode of train to models/profile_<model name>.jsonl,
+                        see Profiler
+        :param name: Name of the saved models and checkpoints, the module-level model_name if None
+        """
+        if target_update not in TARGET_UPDATES:
+            raise ValueError(f"Unknown target update {target_update}, expected one of {TARGET_UPDATES}")
         self.computer_type = computer_type
         self.reward_strategy = reward_strategy
+        self.name = name
         self.device = device
-        self.memory = ReplayMemory(10_000)
+        dim_in = OCP.DIM_IN if self.computer_type == OCP.OpponentComputerPlayer else CP.DIM_IN
+        memory_type = PrioritizedReplayMemory if prioritized else ReplayMemory
+        self.memory = memory_type(memory_capacity, dim_in, CP.DIM_OUT, device)
         if self.computer_type == CP.ComputerPlayer:
             self.policy_net = CP.NeuralNetwork(CP.DIM_IN,
                                                CP.DIM_OUT,
@@ -79,92 +274,327 @@ class Trainer:
                                                OCP.HIDDEN_COUNT,
                                                OCP.DIM_HIDDEN).to(device)
         self.target_net.load_state_dict(self.policy_net.state_dict())
+        self.policy_parameters = list(self.policy_net.parameters())
+        self.target_parameters = list(self.target_net.parameters())
+        self.train_every = train_every
+        self.updates_per_step = updates_per_step
+        self.target_update = target_update
+        self.target_update_interval = target_update_interval
+        self.pending_env_steps = 0  # Environment steps since the last learner step
+        self.gradient_steps = 0
+        self.checkpoint_interval = checkpoint_interval
+        self.profile = profile
+        self.profiler = NULL_PROFILER  # The Profiler of a running train if profile is set
 
         self.optimizer = optim.Adam(self.policy_net.parameters())
-        self.loss_fn = nn.SmoothL1Loss()
+        self.lock = threading.RLock()  # Held while updating the replay memory or the networks
+        self.cur_cards = 1
+        self.steps_done = 0
+        self.games_done = 0
+        self.loss_fn = nn.SmoothL1Loss(reduction="none")
 
     def optimize_model(self):
         if len(self.memory) < BATCH_SIZE:
             return
 
-        experiences = self.memory.sample(BATCH_SIZE)
-        in_states = torch.stack([experience.state for experience in experiences], dim=0).to(self.device)
-        actions = torch.stack(
-            [torch.tensor([experience.action], dtype=torch.long, device=self.device) for experience in experiences])
-        rewards = torch.tensor([experience.reward for experience in experiences], dtype=torch.float, device=self.device)
-
-        non_final = torch.tensor([experience.next_state is not None for experience in experiences], dtype=torch.bool,
-                                 device=self.device)
-        non_final_states = torch.stack(
-            [experience.next_state for experience in experiences if experience.next_state is not None], dim=0)
-        non_final_masks = torch.stack(
-            [experience.next_mask for experience in experiences if experience.next_state is not None], dim=0)
+        indices, in_states, actions, rewards, next_states, next_masks, dones, weights = self.memory.sample(BATCH_SIZE)
 
-        next_state_rewards = torch.zeros(BATCH_SIZE, dtype=torch.float, device=self.device)
         with torch.no_grad():
-            unmasked_next_rewards = self.target_net(non_final_states)
-            masked_next_rewards = torch.where(non_final_masks == 1, unmasked_next_rewards, float("-inf"))
-            next_state_rewards[non_final] = masked_next_rewards.max(1).values
+            unmasked_next_rewards = self.target_net(next_states)
+            masked_next_rewards = torch.where(next_masks == 1, unmasked_next_rewards, float("-inf"))
+            next_state_rewards = torch.where(dones, 0.0, masked_next_rewards.max(1).values)
         expected_rewards = rewards + GAMMA * next_state_rewards
 
         output = self.policy_net(in_states)
-        pred_rewards = output.gather(1, actions).squeeze()
+        pred_rewards = output.gather(1, actions.unsqueeze(1)).squeeze(1)
 
         self.optimizer.zero_grad()
-        loss = self.loss_fn(pred_rewards, expected_rewards)
+        losses = self.loss_fn(pred_rewards, expected_rewards)
+        loss = losses.mean() if weights is None else (losses * weights).mean()
         loss.backward()
         self.optimizer.step()
 
-    def train(self):
-        cur_cards = 1
-        steps_done = 0
-        for episode in tqdm(range(NUM_GAMES)):
-            game = Game(num_human_players=0, num_computer_players=NUM_COMPUTER_PLAYERS, model=self.policy_net,
-                        computer_type=self.computer_type, reward_strategy=self.reward_strategy, device=self.device,
-                        num_stock_cards=cur_cards, names=["", ""])
-            last_experience = [None for _ in range(NUM_COMPUTER_PLAYERS)]
-            while game.is_game_running:
-                for current_player_index in range(NUM_COMPUTER_PLAYERS):
-                    current_player = game.players[current_player_index]
-                    current_player.end_turn = False
-                    current_player.fill_hand()
-                    while not current_player.end_turn and game.is_game_running:
+        self.memory.update_priorities(indices, (pred_rewards - expected_rewards).detach().abs())
+
+    def update_target_net(self):
+        # In place on the parameter tensors instead of a new state dict, fused into one kernel per step by the
+        # private foreach ops when this torch version has them
+        with torch.no_grad():
+            if self.target_update == "soft":
+                if hasattr(torch, "_foreach_lerp_"):
+                    torch._foreach_lerp_(self.target_parameters, self.policy_parameters, TAU)
+                else:
+                    for target, policy in zip(self.target_parameters, self.policy_parameters):
+                        target.lerp_(policy, TAU)
+            elif hasattr(torch, "_foreach_copy_"):
+                torch._foreach_copy_(self.target_parameters, self.policy_parameters)
+            else:
+                for target, policy in zip(self.target_parameters, self.policy_parameters):
+                    target.copy_(policy)
+
+    def learn(self, env_steps):
+        """
+        Learner schedule, called after env_steps environment steps (actions) were played.
+        Does updates_per_step gradient steps for every train_every environment steps, and updates the target net
+        every target_update_interval gradient steps.
+        """
+        if self.train_every is None:
+            learner_steps = 1
+        else:
+            self.pending_env_steps += env_steps
+            learner_steps = self.pending_env_steps // self.train_every
+            self.pending_env_steps -= learner_steps * self.train_every
+        for _ in range(learner_steps * self.updates_per_step):
+            if len(self.memory) < BATCH_SIZE:
+                return
+            with self.profiler.phase("optimize"):
+                self.optimize_model()
+            self.gradient_steps += 1
+            if self.gradient_steps % self.target_update_interval == 0:
+                with self.profiler.phase("target"):
+                    self.update_target_net()
+
+    def model_name(self):
+        return model_name(self.computer_type, self.reward_strategy) if self.name is None else self.name
+
+    def checkpoint_path(self):
+        return os.path.join(CHECKPOINT_DIR, f"{self.model_name()}.pth")
+
+    def save_checkpoint(self, path=None):
+        """
+        Saves the networks, optimizer, replay memory, counters and random number generator states, so training can be
+        resumed with load_checkpoint as if it was never interrupted (apart from the games that were being played).
+        The checkpoint is written to a temporary file first, so an interruption never leaves a broken checkpoint.
+        """
+        path = self.checkpoint_path() if path is None else path
+        checkpoint = {
+            "policy_net": self.policy_net.state_dict(),
+            "target_net": self.target_net.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "memory": self.memory.state_dict(),
+            "cur_cards": self.cur_cards,
+            "steps_done": self.steps_done,
+            "games_done": self.games_done,
+            "pending_env_steps": self.pending_env_steps,
+            "gradient_steps": self.gradient_steps,
+            "random": random.getstate(),
+            "numpy_random": np.random.get_state(),
+            "torch_random": torch.get_rng_state(),
+            "cuda_random": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+        }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        torch.save(checkpoint, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def load_checkpoint(self, path=None):
+        path = self.checkpoint_path() if path is None else path
+        checkpoint = torch.load(path, map_location=self.device, weights_only=False)
+        self.policy_net.load_state_dict(checkpoint["policy_net"])
+        self.target_net.load_state_dict(checkpoint["target_net"])
+        self.optimizer.load_state_dict(checkpoint["optimizer"])
+        self.memory.load_state_dict(checkpoint["memory"])
+        self.cur_cards = checkpoint["cur_cards"]
+        self.steps_done = checkpoint["steps_done"]
+        self.games_done = checkpoint["games_done"]
+        self.pending_env_steps = checkpoint["pending_env_steps"]
+        self.gradient_steps = checkpoint["gradient_steps"]
+        random.setstate(checkpoint["random"])
+        np.random.set_state(checkpoint["numpy_random"])
+        torch.set_rng_state(checkpoint["torch_random"].cpu())
+        if checkpoint["cuda_random"] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all([state.cpu() for state in checkpoint["cuda_random"]])
+
+    def start_training(self, resume):
+        """
+        Resets the counters of a training run, or restores the whole training state from the checkpoint if resume is
+        set and there is one
+        """
+        self.cur_cards = 1
+        self.steps_done = 0
+        self.games_done = 0
+        if resume and os.path.exists(self.checkpoint_path()):
+            self.load_checkpoint()
+
+    def play_episode(self, episode, model):
+        """
+        Plays one training game. Replay memory and network updates happen under self.lock, so games in other threads
+        can be played at the same time.
+        """
+        game = Game(num_human_players=0, num_computer_players=NUM_COMPUTER_PLAYERS, model=model,
+                    computer_type=self.computer_type, reward_strategy=self.reward_strategy, device=self.device,
+                    num_stock_cards=self.cur_cards, names=["", ""])
+        game_stock_cards = self.cur_cards
+        last_experience = [None for _ in range(NUM_COMPUTER_PLAYERS)]
+        profiler = self.profiler
+        while game.is_game_running:
+            for current_player_index in range(NUM_COMPUTER_PLAYERS):
+                game.current_player_index = current_player_index
+                current_player = game.players[current_player_index]
+                with profiler.phase("refill"):
+                    current_player.start_turn()
+                while not current_player.end_turn and game.is_game_running:
+                    with profiler.phase("mask"):
                         current_player.compute_mask()
+                    with profiler.phase("encode"):
                         current_player.compute_model_input()
-                        if last_experience[current_player_index] is not None:
-                            last_experience[current_player_index].next_state = current_player.model_input
-                            last_experience[current_player_index].next_mask = current_player.mask
+                    if last_experience[current_player_index] is not None:
+                        last_experience[current_player_index].next_state = current_player.model_input
+                        last_experience[current_player_index].next_mask = current_player.mask
+                        with profiler.phase("replay"), self.lock:
                             self.memory.add(last_experience[current_player_index])
-                        in_state = current_player.model_input
-                        action, reward = current_player.select_and_do_action(training=True, steps_done=steps_done, verbose=False)
-                        steps_done += 1
-                        last_experience[current_player_index] = Experience(in_state, action, reward, None, None)
-
-                        self.optimize_model()
-
-                        target_net_state_dict = self.target_net.state_dict()
-                        policy_net_state_dict = self.policy_net.state_dict()
-                        for key in policy_net_state_dict:
-                            target_net_state_dict[key] = policy_net_state_dict[key] * TAU + target_net_state_dict[
-                                key] * (1 - TAU)
-                        self.target_net.load_state_dict(target_net_state_dict)
-            # Check if someone won
-            someone_won = False
-            for current_player_index in range(NUM_COMPUTER_PLAYERS):
-                if len(game.players[current_player_index].stock_pile) == 0:
-                    someone_won = True
-                    if cur_cards < MAX_NUM_CARDS:
-                        cur_cards += 1
+                    # The model input tensor is reused for the next action, so keep a copy of this state
+                    in_state = current_player.model_input.clone()
+                    with profiler.phase("select"):
+                        action = current_player.select_action(training=True, verbose=False,
+                                                              steps_done=self.steps_done)
+                    with profiler.phase("transition"):
+                        action, reward = current_player.do_action(action, training=True)
+                    last_experience[current_player_index] = Experience(in_state, action, reward, None, None)
 
+                    with self.lock:
+                        self.steps_done += 1
+                        self.learn(1)
+        # Check if someone won
+        someone_won = any(len(game.players[index].stock_pile) == 0 for index in range(NUM_COMPUTER_PLAYERS))
+
+        with self.lock:
+            # Games of other threads finish at the same time, so the curriculum is advanced under the lock
+            if someone_won:
+                self.cur_cards = min(MAX_NUM_CARDS, self.cur_cards + 1)
             for current_player_index in range(NUM_COMPUTER_PLAYERS):
                 current_player = game.players[current_player_index]
                 if last_experience[current_player_index] is not None:
                     if someone_won and len(current_player.stock_pile) > 0:
-                        last_experience[current_player_index].reward += current_player.reward_strategy.reward_loss()
+                        last_experience[current_player_index].reward += current_player.reward_strategy.loss_reward
                     self.memory.add(last_experience[current_player_index])
-            if (episode + 1) % (NUM_GAMES // 10) == 0:
-                model_name = str(game.players[0])
-                torch.save(self.policy_net.state_dict(), f"models/exploit_{model_name}_{episode + 1}.pth")
+            with profiler.phase("checkpoint"):
+                if (episode + 1) % (NUM_GAMES // 10) == 0:
+                    torch.save(self.policy_net.state_dict(), f"models/exploit_{self.model_name()}_{episode + 1}.pth")
+                self.games_done += 1
+                if self.games_done % self.checkpoint_interval == 0:
+                    self.save_checkpoint()
+        profiler.end_episode(episode, num_stock_cards=game_stock_cards, won=someone_won)
+
+    def train(self, num_parallel_games=1, start_episode=0, resume=False):
+        """
+        num_parallel_games: Number of games played at the same time in separate threads. If more than one, the games
+                            select their actions through an InferenceServer that batches them into one forward pass.
+        start_episode: First episode to play, to continue an earlier run of which the policy net was loaded
+        resume: Continue from the checkpoint of an earlier run if there is one, instead of start_episode
+        Returns the number of games played
+        """
+        self.start_training(resume)
+        if self.games_done > 0:
+            start_episode = self.games_done
+        self.games_done = start_episode
+        episodes = range(start_episode, NUM_GAMES)
+        if self.profile:
+            self.profiler = Profiler(os.path.join("models", f"profile_{self.model_name()}.jsonl"))
+        try:
+            if num_parallel_games == 1:
+                for episode in tqdm(episodes):
+                    self.play_episode(episode, self.policy_net)
+                return len(episodes)
+
+            with InferenceServer(self.policy_net, max_batch_size=num_parallel_games, lock=self.lock) as server:
+                with ThreadPoolExecutor(num_parallel_games) as pool:
+                    results = pool.map(lambda episode: self.play_episode(episode, server), episodes)
+                    for _ in tqdm(results, total=len(episodes)):
+                        pass
+            return len(episodes)
+        finally:
+            self.profiler.close()
+            self.profiler = NULL_PROFILER
+
+    def add_transitions(self, transitions):
+        if transitions is not None:
+            self.memory.add_batch(*(torch.from_numpy(array).to(self.device) for array in transitions))
+
+    def finish_games(self, finished, won):
+        """
+        Bookkeeping for train_vectorized and train_distributed after finished games of which won had a winner:
+        increases the number of stock cards, saves the policy net every NUM_GAMES // 10 games and a checkpoint every
+        checkpoint_interval games
+        """
+        self.cur_cards = min(MAX_NUM_CARDS, self.cur_cards + won)
+        save_interval = NUM_GAMES // 10
+        if (self.games_done + finished) // save_interval > self.games_done // save_interval:
+            episode = (self.games_done + finished) // save_interval * save_interval
+            torch.save(self.policy_net.state_dict(), f"models/exploit_{self.model_name()}_{episode}.pth")
+        previous_games_done = self.games_done
+        self.games_done += finished
+        if self.games_done // self.checkpoint_interval > previous_games_done // self.checkpoint_interval:
+            self.save_checkpoint()
+
+    def train_vectorized(self, num_envs=256, resume=False):
+        """
+        Same training loop as train, but plays num_envs games at once in a VecSkipBoEnv.
+        Every step selects the actions of all games with one batched forward pass.
+        resume: Continue from the checkpoint of an earlier run if there is one, the games that were being played when
+                it was saved are lost
+        """
+        self.start_training(resume)
+        env = VecSkipBoEnv(num_envs, num_stock_cards=self.cur_cards,
+                           opponent_input=self.computer_type == OCP.OpponentComputerPlayer,
+                           reward_weights=self.reward_strategy.weights,
+                           seed=np.random.randint(2**63, dtype=np.int64))  # From the checkpointed global generator
+        tracker = TransitionTracker(num_envs, env.dim_in)
+        obs, mask = env.reset()
+        with tqdm(total=NUM_GAMES, initial=self.games_done) as progress:
+            while self.games_done < NUM_GAMES:
+                self.add_transitions(tracker.before_step(obs, mask, env.current))
+                actions = CP.select_actions(self.policy_net, torch.from_numpy(obs).to(self.device),
+                                            torch.from_numpy(mask).to(self.device),
+                                            CP.epsilon_threshold(self.steps_done)).cpu().numpy()
+                next_obs, next_mask, rewards, dones, info = env.step(actions)
+                self.add_transitions(tracker.after_step(obs, actions, rewards, dones, info))
+                self.steps_done += num_envs
+                self.learn(num_envs)
+
+                finished = int(dones.sum())
+                if finished > 0:
+                    self.finish_games(finished, int((info["winner"][dones] >= 0).sum()))
+                    env.set_num_stock_cards(self.cur_cards)
+                    progress.update(finished)
+                obs, mask = next_obs, next_mask
+
+    def train_distributed(self, num_actors=4, envs_per_actor=64, weight_refresh_interval=10, resume=False):
+        """
+        Plays the games in num_actors worker processes (see ActorPool), each running envs_per_actor games in a
+        VecSkipBoEnv, while this process only learns from the transitions they send.
+        weight_refresh_interval: Number of steps an actor plays before it checks for newer policy weights
+        resume: Continue from the checkpoint of an earlier run if there is one
+        """
+        self.start_training(resume)
+        opponent = self.computer_type == OCP.OpponentComputerPlayer
+        pool = ActorPool(self.policy_net, opponent, self.reward_strategy.weights, num_actors,
+                         envs_per_actor, weight_refresh_interval)
+        pool.steps_done.value = self.steps_done
+        pool.num_stock_cards.value = self.cur_cards
+        pool.start()
+        learner_steps = 0
+        try:
+            with tqdm(total=NUM_GAMES, initial=self.games_done) as progress:
+                while self.games_done < NUM_GAMES:
+                    message = pool.get()
+                    if message is None:
+                        continue
+                    transitions, finished, won = message
+                    for batch in transitions:
+                        self.add_transitions(batch)
+                    env_steps = pool.steps_done.value - self.steps_done
+                    self.steps_done += env_steps
+                    self.learn(env_steps)
+                    learner_steps += 1
+                    if learner_steps % PUBLISH_INTERVAL == 0:
+                        pool.publish(self.policy_net)
+
+                    if finished > 0:
+                        self.finish_games(finished, won)
+                        pool.num_stock_cards.value = self.cur_cards
+                        progress.update(finished)
+        finally:
+            pool.close()
 
 
 if __name__ == "__main__":
@@ -172,13 +602,7 @@ if __name__ == "__main__":
     print(device)
 
     computer_types = [OCP.OpponentComputerPlayer, CP.ComputerPlayer]
-    strategies = [
-        WinOnlyRewardStrategy, LossOnlyRewardStrategy, DiscardStockRewardStrategy,
-        WinStockRewardStrategy, PunishRewardStrategy, DiscardRewardStrategy,
-        DiscardWinRewardStrategy, EverythingRewardStrategy, StockRewardStrategy,
-        WinLossRewardStrategy, ComplexRewardStrategy,
-    ]
     for computer_type in computer_types:
-        for strategy in strategies:
+        for strategy in PRESETS.values():
             trainer = Trainer(computer_type, strategy, device)
             trainer.train()
@@ -0,0 +1,240 @@
+import random
+
+import numpy as np
+
+from ActionSpace import DECODED, KIND_DISCARD_TO_BUILD, KIND_HAND_TO_BUILD, KIND_HAND_TO_DISCARD, KIND_STOCK_TO_BUILD
+from Card import JOKER
+from ComputerPlayer import ComputerPlayer
+from MaskEngine import MaskEngine
+from MCTSComputerPlayer import SimGame
+from NumpyPolicy import policy_of
+from StateEncoder import DIM_IN_OPPONENT, StateEncoder
+
+MAX_NODES = 2_000  # Positions per plan, build plays beyond this are scored as leaves
+# Heuristic values of a plan, in cards played from the hand
+STOCK_VALUE = 10.0  # Playing the stock card
+HAND_PLAY_VALUE = 1.0  # Every card played from the hand
+REFILL_VALUE = 2.0  # Playing the last card of the hand, which draws a new hand
+DISCARD_PLAY_VALUE = 0.8  # Every card played from a discard pile
+JOKER_COST = 1.5  # Every joker played on a build pile, they are worth more when the stock card needs one
+OPPONENT_STOCK_COST = 3.0  # Leaving build piles the stock card of an opponent fits on
+STACK_VALUE = 0.5  # Discarding on a pile with the same or one higher card on top
+EMPTY_PILE_VALUE = 0.3  # Discarding on an empty pile
+BURY_COST = 0.5  # Discarding on any other pile
+JOKER_DISCARD_COST = 5.0  # Discarding a joker
+HIGH_CARD_VALUE = 0.1  # Per face value of the discarded card, high cards are the hardest to play
+
+
+class PlanNode:
+    """
+    A position in the turn being planned.
+    children: The positions reached by build plays, by action
+    leaves:   Actions that end the plan: discards, which end the turn, and plays that reveal cards (the stock card, or
+              the last card of the hand). The player plans again after those.
+    """
+    __slots__ = ("children", "leaves", "leaf_values", "encoding", "value", "best")
+
+    def __init__(self):
+        self.children = {}
+        self.leaves = []
+        self.leaf_values = None
+        self.encoding = None
+        self.value = None
+        self.best = None
+
+
+class TurnPlanner:
+    """
+    Plans the plays of a player up to the next discard, or to the next play that reveals a card, with a depth first
+    search over every order of build plays. Positions are memoized on the hand histogram, the build pile tops, the
+    discard piles and the stock top, so orders of plays that lead to the same position are searched once.
+    The leaves are scored by the heuristic of leaf_value, or with a policy by its Q-values of the leaf actions. All
+    positions of a plan are then evaluated in a single batched forward pass.
+    """
+
+    def __init__(self, num_players, player_index, policy=None, max_nodes=MAX_NODES):
+        self.game = SimGame(num_players, random.Random())
+        self.player_index = player_index
+        self.player = self.game.players[player_index]
+        self.mask_engine = MaskEngine(self.player)
+        self.policy = policy
+        if policy is not None:
+            self.encoder = StateEncoder(self.player, policy.dim_in == DIM_IN_OPPONENT)
+        self.max_nodes = max_nodes
+        self.nodes = {}
+        self.root_hand = self.root_discards = self.root_jokers = 0
+
+    def key(self):
+        player = self.player.state
+        return (bytes(player.hand_counts) + bytes(self.game.state.build_tops)
+                + bytes([pile[-1] if len(pile) > 0 else 0 for pile in player.discard_piles])
+                + bytes([len(pile) for pile in player.discard_piles]) + bytes(player.stock_pile[-1:]))
+
+    def jokers(self):
+        player = self.player.state
+        return player.hand_counts[JOKER] + sum(pile.count(JOKER) for pile in player.discard_piles)
+
+    def play(self, action):
+        """
+        Plays a build play from the hand or a discard pile, returns what undo needs to take it back
+        """
+        state = self.game.state
+        player = self.player.state
+        kind, face, discard_index, build_index = DECODED[action]
+        if kind == KIND_DISCARD_TO_BUILD:
+            face = player.discard_piles[discard_index][-1]
+        undo = (kind, face, discard_index, build_index, state.build_tops[build_index], state.build_jokers[build_index],
+                len(state.removed_pile))
+        if kind == KIND_HAND_TO_BUILD:
+            state.remove_from_hand(player, face)
+            state.play_on_build_pile(face, build_index)
+        else:
+            state.play_discard_to_build(player, discard_index, build_index)
+        return undo
+
+    def undo(self, undo):
+        kind, face, discard_index, build_index, build_top, build_jokers, removed = undo
+        state = self.game.state
+        player = self.player.state
+        state.build_tops[build_index] = build_top
+        state.build_jokers[build_index] = build_jokers
+        del state.removed_pile[removed:]
+        if kind == KIND_HAND_TO_BUILD:
+            player.hand.append(face)
+            player.hand_counts[face] += 1
+        else:
+            player.discard_piles[discard_index].append(face)
+
+    def position_value(self):
+        """
+        Heuristic value of the current position compared to the start of the plan
+        """
+        state = self.game.state
+        player = self.player.state
+        value = (HAND_PLAY_VALUE * (self.root_hand - len(player.hand))
+                 + DISCARD_PLAY_VALUE * (self.root_discards - sum(map(len, player.discard_piles)))
+                 - JOKER_COST * (self.root_jokers - self.jokers()))
+        for index, opponent in enumerate(state.players):
+            if index != self.player_index and len(opponent.stock_pile) > 0 and opponent.stock_pile[-1] != JOKER \
+                    and opponent.stock_pile[-1] - 1 in state.build_tops:
+                value -= OPPONENT_STOCK_COST
+        return value
+
+    def leaf_value(self, action, position_value):
+        player = self.player.state
+        kind, face, _, discard_index = DECODED[action]
+        if kind == KIND_STOCK_TO_BUILD:
+            return position_value + STOCK_VALUE
+        if kind == KIND_HAND_TO_DISCARD:
+            if face == JOKER:
+                return position_value - JOKER_DISCARD_COST
+            pile = player.discard_piles[discard_index]
+            if len(pile) == 0:
+                value = EMPTY_PILE_VALUE
+            elif pile[-1] == face or pile[-1] == face + 1:
+                value = STACK_VALUE
+            else:
+                value = -BURY_COST
+            return position_value + value + HIGH_CARD_VALUE * face
+        # A build play that is not searched further
+        value = HAND_PLAY_VALUE if kind == KIND_HAND_TO_BUILD else DISCARD_PLAY_VALUE
+        if kind == KIND_HAND_TO_BUILD and len(player.hand) == 1:
+            value += REFILL_VALUE
+        return position_value + value
+
+    def expand(self):
+        key = self.key()
+        node = self.nodes.get(key)
+        if node is not None:
+            return node
+        node = self.nodes[key] = PlanNode()
+        self.mask_engine.update()
+        for action in self.mask_engine.legal_actions().tolist():
+            kind = DECODED[action][0]
+            if kind == KIND_STOCK_TO_BUILD or kind == KIND_HAND_TO_DISCARD \
+                    or (kind == KIND_HAND_TO_BUILD and len(self.player.state.hand) == 1) \
+                    or len(self.nodes) >= self.max_nodes:
+                node.leaves.append(action)
+            else:
+                undo = self.play(action)
+                node.children[action] = self.expand()
+                self.undo(undo)
+        # The mask engine was updated by the children, the encoding and values are of this position
+        if self.policy is not None:
+            node.encoding = self.encoder.encode().copy()
+        else:
+            position_value = self.position_value()
+            node.leaf_values = [self.leaf_value(action, position_value) for action in node.leaves]
+        return node
+
+    def best_value(self, node):
+        if node.value is None:
+            node.value = -np.inf
+            for action, value in zip(node.leaves, node.leaf_values):
+                if value > node.value:
+                    node.value, node.best = value, action
+            for action, child in node.children.items():
+                value = self.best_value(child)
+                if value > node.value:
+                    node.value, node.best = value, action
+        return node.value
+
+    def plan(self, snapshot):
+        """
+        Actions to play from the position of a snapshot of the Game, the last one is a discard or a play that reveals
+        a card
+        """
+        self.game.restore(snapshot)
+        player = self.player.state
+        self.root_hand = len(player.hand)
+        self.root_discards = sum(map(len, player.discard_piles))
+        self.root_jokers = self.jokers()
+        self.nodes = {}
+        if self.policy is not None:
+            self.encoder.start_turn()
+        root = self.expand()
+        if self.policy is not None:
+            nodes = list(self.nodes.values())
+            q = self.policy.forward(np.stack([node.encoding for node in nodes]))
+            for node, node_q in zip(nodes, q):
+                node.leaf_values = node_q[node.leaves].tolist()
+        self.best_value(root)
+        actions = []
+        node = root
+        while node.best in node.children:
+            actions.append(node.best)
+            node = node.children[node.best]
+        actions.append(node.best)
+        return actions
+
+
+class PlannerComputerPlayer(ComputerPlayer):
+    """
+    Plays the plans of a TurnPlanner, planning again after every card it reveals. With a model the planner scores the
+    plans with it, with one forward pass per plan instead of one per action.
+    """
+    uses_model = False  # The model is only used by the planner, as a NumpyPolicy
+
+    def __init__(self, game, model, device, reward_strategy=None, name="", max_nodes=MAX_NODES):
+        super().__init__(game, model, device, reward_strategy, name)
+        self.policy = policy_of(model)
+        self.max_nodes = max_nodes
+        self.planner = None
+        self.planned = []
+
+    def start_turn(self):
+        super().start_turn()
+        self.planned = []
+
+    def select_action(self, training, verbose, steps_done):
+        if not self.planned:
+            legal = self.mask_engine.legal_actions()
+            if len(legal) <= 1:
+                return int(legal[0]) if len(legal) == 1 else 0
+            if self.planner is None:
+                self.planner = TurnPlanner(len(self.game.players), self.game.players.index(self), self.policy,
+                                           self.max_nodes)
+            self.planned = self.planner.plan(self.game.snapshot(with_rng=False))
+            if verbose:
+                print(f"Plan: {self.planned}")
+        return self.planned.pop(0)
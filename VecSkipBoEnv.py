@@ -0,0 +1,338 @@
+import numpy as np
+
+import ActionSpace
+from ActionSpace import (DISCARD_TO_BUILD, FACES, HAND_TO_DISCARD, KINDS, KIND_DISCARD_TO_BUILD, KIND_HAND_TO_BUILD,
+                         KIND_HAND_TO_DISCARD, KIND_STOCK_TO_BUILD, SOURCES, STOCK_TO_BUILD, TARGETS)
+import Card
+from Card import JOKER, NUM_FACES
+import ComputerPlayer as CP
+from RewardEngine import ACTION_EVENTS, LOSS, NUM_EVENTS, RewardEngine, RewardSpec, WIN
+
+NUM_PLAYERS = 2
+NUM_PILES = 4
+# Same faces as Card, so face - 1 is the offset in the mask and the model input
+DECK = np.array(Card.DECK, dtype=np.uint8)
+DECK_SIZE = len(DECK)
+MAX_STOCK_CARDS = 30
+HAND_SIZE = 5
+
+# Same layout as ComputerPlayer.model_input and OpponentComputerPlayer.model_input
+OPPONENT_OFFSET = 13 + 13 * 4 + 13 + 12 * 4 + 1
+
+class VecSkipBoEnv:
+    """
+    Plays num_envs two player games of SkipBo in lockstep, with the state of every game stored in NumPy arrays.
+    Follows the same rules as Game and Player, but every step applies one action in every game at once.
+
+    Observations and masks are always given for the player whose turn it is (see self.current), using the same layout
+    as ComputerPlayer (127 values) or OpponentComputerPlayer (193 values, if opponent_input is set).
+    Finished games are reset automatically, the observation returned for them belongs to the new game.
+    """
+
+    def __init__(self, num_envs, num_stock_cards=30, opponent_input=False, reward_weights=None, seed=None):
+        assert 1 <= num_stock_cards <= MAX_STOCK_CARDS
+        self.num_envs = num_envs
+        self.num_stock_cards = np.full(num_envs, num_stock_cards, dtype=np.int16)
+        self.dim_in = OPPONENT_OFFSET + 13 * 4 + 13 + 1 if opponent_input else OPPONENT_OFFSET
+        self.opponent_input = opponent_input
+        # reward_weights are the weights of a RewardSpec
+        self.reward_engine = RewardEngine([RewardSpec("", **(reward_weights or {}))])
+        self.rng = np.random.default_rng(seed)
+
+        n = num_envs
+        self.draw_pile = np.zeros((n, DECK_SIZE), dtype=np.uint8)
+        self.draw_len = np.zeros(n, dtype=np.int16)
+        self.removed_pile = np.zeros((n, DECK_SIZE), dtype=np.uint8)
+        self.removed_len = np.zeros(n, dtype=np.int16)
+        # A build pile always holds the cards 1, 2, .., top. Bit (value - 1) is set if that value is played by a joker
+        self.build_top = np.zeros((n, NUM_PILES), dtype=np.int16)
+        self.build_jokers = np.zeros((n, NUM_PILES), dtype=np.int16)
+        # The hand is kept as a histogram of faces, the order of the cards in a hand does not matter
+        self.hand = np.zeros((n, NUM_PLAYERS, NUM_FACES), dtype=np.int16)
+        self.hand_len = np.zeros((n, NUM_PLAYERS), dtype=np.int16)
+        self.stock_pile = np.zeros((n, NUM_PLAYERS, MAX_STOCK_CARDS), dtype=np.uint8)
+        self.stock_len = np.zeros((n, NUM_PLAYERS), dtype=np.int16)
+        self.discard_piles = np.zeros((n, NUM_PLAYERS, NUM_PILES, DECK_SIZE), dtype=np.uint8)
+        self.discard_len = np.zeros((n, NUM_PLAYERS, NUM_PILES), dtype=np.int16)
+
+        self.current = np.zeros(n, dtype=np.int64)
+        self.first = np.zeros(n, dtype=np.int64)
+        self.turns = np.zeros(n, dtype=np.int64)
+        self.actions = np.zeros((n, NUM_PLAYERS), dtype=np.int64)
+        self.running = np.zeros(n, dtype=bool)
+        self.mask = np.zeros((n, CP.DIM_OUT), dtype=np.float32)
+
+        self._envs = np.arange(n)
+        self._values = np.arange(1, 13, dtype=np.uint8)
+        self._faces = np.arange(1, NUM_FACES + 1, dtype=np.int16)
+
+    def set_num_stock_cards(self, num_stock_cards):
+        """
+        Sets the number of stock cards used by games that start after this call
+        """
+        assert 1 <= num_stock_cards <= MAX_STOCK_CARDS
+        self.num_stock_cards[:] = num_stock_cards
+
+    def reset(self):
+        """
+        Starts a new game in every environment.
+        Returns the observations and legal action masks for the players that move first.
+        """
+        self._reset_envs(self._envs)
+        return self._observe(), self._compute_mask()
+
+    def step(self, actions):
+        """
+        Applies one action in every game, for the player whose turn it is.
+        actions: Integer array of shape (num_envs,) using the action layout of ComputerPlayer.mask
+        Returns (observations, masks, rewards, dones, info):
+            rewards has shape (num_envs, 2) with the reward for every seat, so the loser also gets the loss reward
+            info["actor"] is the seat that took the action, info["winner"] is the winning seat or -1 if nobody won,
+            info["turns"] and info["actions"] are the turn count and per seat action count of finished games.
+            info["events"] has shape (num_envs, 2, NUM_EVENTS) with the events the rewards are computed from, so the
+            rewards of other RewardSpecs can be computed from the same steps with a RewardEngine.
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        if not self.mask[self._envs, actions].all():
+            raise ValueError("Illegal action")
+        actor = self.current.copy()
+        events = np.zeros((self.num_envs, NUM_PLAYERS, NUM_EVENTS), dtype=np.float32)
+        events[self._envs, actor] = ACTION_EVENTS[actions]
+        winner = np.full(self.num_envs, -1, dtype=np.int64)
+        self.actions[self._envs, actor] += 1
+
+        kinds = KINDS[actions]
+        targets = TARGETS[actions]
+
+        envs = self._envs[kinds == KIND_HAND_TO_BUILD]
+        if len(envs) > 0:
+            players = actor[envs]
+            faces = FACES[actions[envs]]
+            self.hand[envs, players, faces - 1] -= 1
+            self.hand_len[envs, players] -= 1
+            self._play_to_build(envs, targets[envs], faces)
+            empty = self.hand_len[envs, players] == 0
+            self._fill_hands(envs[empty], players[empty])
+
+        envs = self._envs[kinds == KIND_HAND_TO_DISCARD]
+        if len(envs) > 0:
+            players = actor[envs]
+            faces = FACES[actions[envs]]
+            piles = targets[envs]
+            self.hand[envs, players, faces - 1] -= 1
+            self.hand_len[envs, players] -= 1
+            self.discard_piles[envs, players, piles, self.discard_len[envs, players, piles]] = faces
+            self.discard_len[envs, players, piles] += 1
+            # End of the turn, the next player fills their hand before their first action
+            self.current[envs] = 1 - players
+            self.turns[envs] += self.current[envs] == self.first[envs]
+            self._fill_hands(envs, self.current[envs])
+
+        envs = self._envs[kinds == KIND_DISCARD_TO_BUILD]
+        if len(envs) > 0:
+            players = actor[envs]
+            piles = SOURCES[actions[envs]]
+            self.discard_len[envs, players, piles] -= 1
+            faces = self.discard_piles[envs, players, piles, self.discard_len[envs, players, piles]]
+            self._play_to_build(envs, targets[envs], faces)
+
+        envs = self._envs[kinds == KIND_STOCK_TO_BUILD]
+        if len(envs) > 0:
+            players = actor[envs]
+            self.stock_len[envs, players] -= 1
+            faces = self.stock_pile[envs, players, self.stock_len[envs, players]]
+            self._play_to_build(envs, targets[envs], faces)
+            won = self.stock_len[envs, players] == 0
+            envs, players = envs[won], players[won]
+            winner[envs] = players
+            events[envs, players, WIN] = 1
+            events[envs, 1 - players, LOSS] = 1
+            self.running[envs] = False
+
+        dones = ~self.running
+        rewards = self.reward_engine.rewards(events)[..., 0]
+        info = {"actor": actor, "winner": winner, "turns": self.turns.copy(), "actions": self.actions.copy(),
+                "events": events}
+        finished = self._envs[dones]
+        if len(finished) > 0:
+            self._reset_envs(finished)
+        return self._observe(), self._compute_mask(), rewards, dones, info
+
+    def sample_legal_actions(self, mask=None):
+        """
+        Picks a uniformly random legal action in every game, like RandomComputerPlayer does
+        """
+        mask = self.mask if mask is None else mask
+        return ActionSpace.sample_legal_actions(mask, self.rng)
+
+    def _reset_envs(self, envs):
+        count = len(envs)
+        self.draw_pile[envs] = self.rng.permuted(np.broadcast_to(DECK, (count, DECK_SIZE)), axis=1)
+        self.removed_len[envs] = 0
+        self.build_top[envs] = 0
+        self.build_jokers[envs] = 0
+        self.hand[envs] = 0
+        self.hand_len[envs] = 0
+        self.discard_len[envs] = 0
+        self.actions[envs] = 0
+        self.turns[envs] = 1
+        self.first[envs] = self.rng.integers(NUM_PLAYERS, size=count)
+        self.current[envs] = self.first[envs]
+        self.running[envs] = True
+
+        # Deal the stock piles one card per player at a time from the top of the draw pile, as Game does
+        for num_cards in np.unique(self.num_stock_cards[envs]):
+            group = envs[self.num_stock_cards[envs] == num_cards]
+            dealt = self.draw_pile[group, DECK_SIZE - NUM_PLAYERS * num_cards:][:, ::-1]
+            order = (np.arange(NUM_PLAYERS)[:, None] + self.first[group][:, None, None]) % NUM_PLAYERS
+            dealt = dealt.reshape(len(group), num_cards, NUM_PLAYERS).transpose(0, 2, 1)
+            self.stock_pile[group[:, None], order[..., 0], :num_cards] = dealt
+            self.stock_len[group] = num_cards
+            self.draw_len[group] = DECK_SIZE - NUM_PLAYERS * num_cards
+
+        for seat in range(NUM_PLAYERS):
+            self._fill_hands(envs, (self.first[envs] + seat) % NUM_PLAYERS)
+
+    def _fill_hands(self, envs, players):
+        for _ in range(HAND_SIZE):
+            needs_card = (self.hand_len[envs, players] < HAND_SIZE) & self.running[envs]
+            envs, players = envs[needs_card], players[needs_card]
+            if len(envs) == 0:
+                return
+            for env in envs[self.draw_len[envs] == 0]:
+                self._reshuffle(env)
+            has_card = self.draw_len[envs] > 0
+            self.running[envs[~has_card]] = False  # Nothing left to draw, everyone lost
+            envs, players = envs[has_card], players[has_card]
+            self.draw_len[envs] -= 1
+            faces = self.draw_pile[envs, self.draw_len[envs]]
+            self.hand[envs, players, faces - 1] += 1
+            self.hand_len[envs, players] += 1
+
+    def _reshuffle(self, env):
+        count = self.removed_len[env]
+        self.draw_pile[env, :count] = self.rng.permutation(self.removed_pile[env, :count])
+        self.draw_len[env] = count
+        self.removed_len[env] = 0
+
+    def _play_to_build(self, envs, piles, faces):
+        tops = self.build_top[envs, piles]
+        jokers = faces == JOKER
+        self.build_jokers[envs[jokers], piles[jokers]] |= (1 << tops[jokers]).astype(np.int16)
+        self.build_top[envs, piles] = tops + 1
+
+        full = self.build_top[envs, piles] == 12
+        envs, piles = envs[full], piles[full]
+        if len(envs) > 0:
+            bits = self.build_jokers[envs, piles]
+            cleared = np.where((bits[:, None] >> np.arange(12)) & 1, JOKER, self._values).astype(np.uint8)
+            columns = self.removed_len[envs][:, None] + np.arange(12)
+            self.removed_pile[envs[:, None], columns] = cleared
+            self.removed_len[envs] += 12
+            self.build_top[envs, piles] = 0
+            self.build_jokers[envs, piles] = 0
+
+    def _tops(self, piles, lengths):
+        """
+        Top card of every pile, 0 for empty piles. piles has the cards on the last axis.
+        """
+        index = np.maximum(lengths, 1) - 1
+        tops = np.take_along_axis(piles, index[..., None].astype(np.int64), axis=-1)[..., 0]
+        return np.where(lengths > 0, tops, 0)
+
+    def _player_block(self, players, size):
+        """
+        One hot encodings of the discard pile tops and stock top, plus the stock count, for the given seats
+        """
+        n = self.num_envs
+        block = np.zeros((n, size), dtype=np.float32)
+        discard_tops = self._tops(self.discard_piles[self._envs, players], self.discard_len[self._envs, players])
+        rows, piles = np.nonzero(discard_tops)
+        block[rows, 13 * piles + discard_tops[rows, piles] - 1] = 1
+        stock_len = self.stock_len[self._envs, players]
+        stock_tops = self._tops(self.stock_pile[self._envs, players], stock_len)
+        has_stock = stock_tops > 0
+        block[self._envs[has_stock], 13 * 4 + stock_tops[has_stock] - 1] = 1
+        return block, stock_len
+
+    def _observe(self):
+        n = self.num_envs
+        players = self.current
+        obs = np.zeros((n, self.dim_in), dtype=np.float32)
+        obs[:, :13] = self.hand[self._envs, players]
+        block, stock_len = self._player_block(players, 13 * 4 + 13)
+        obs[:, 13:13 + 13 * 4 + 13] = block
+        offset = 13 + 13 * 4 + 13
+        obs[self._envs[:, None], offset + 12 * np.arange(4) + self.build_top] = 1
+        obs[:, OPPONENT_OFFSET - 1] = stock_len
+        if self.opponent_input:
+            block, stock_len = self._player_block(1 - players, 13 * 4 + 13)
+            obs[:, OPPONENT_OFFSET:OPPONENT_OFFSET + 13 * 4 + 13] = block
+            obs[:, -1] = stock_len
+        return obs
+
+    def _compute_mask(self):
+        n = self.num_envs
+        players = self.current
+        in_hand = self.hand[self._envs, players] > 0
+        targets = self.build_top + 1  # Value that can be played on every build pile
+        fits = (self._faces[None, :, None] == targets[:, None, :]) | (self._faces[None, :, None] == JOKER)
+        self.mask[:, :HAND_TO_DISCARD] = (in_hand[:, :, None] & fits).reshape(n, HAND_TO_DISCARD)
+        self.mask[:, HAND_TO_DISCARD:DISCARD_TO_BUILD] = np.repeat(in_hand, NUM_PILES, axis=1)
+
+        discard_tops = self._tops(self.discard_piles[self._envs, players], self.discard_len[self._envs, players])
+        fits = (discard_tops[:, :, None] == targets[:, None, :]) | (discard_tops[:, :, None] == JOKER)
+        self.mask[:, DISCARD_TO_BUILD:STOCK_TO_BUILD] = fits.reshape(n, NUM_PILES * NUM_PILES)
+
+        stock_tops = self._tops(self.stock_pile[self._envs, players], self.stock_len[self._envs, players])
+        self.mask[:, STOCK_TO_BUILD:] = (stock_tops[:, None] == targets) | (stock_tops[:, None] == JOKER)
+        return self.mask.copy()
+
+
+class TransitionTracker:
+    """
+    Turns the output of VecSkipBoEnv into (state, action, reward, next state, next mask, done) transitions per seat,
+    the same way Trainer.train pairs the experiences of a player with the next state that player gets to act in.
+    """
+
+    def __init__(self, num_envs, dim_in):
+        self.states = np.zeros((num_envs, NUM_PLAYERS, dim_in), dtype=np.float32)
+        self.actions = np.zeros((num_envs, NUM_PLAYERS), dtype=np.int64)
+        self.rewards = np.zeros((num_envs, NUM_PLAYERS), dtype=np.float32)
+        self.pending = np.zeros((num_envs, NUM_PLAYERS), dtype=bool)
+        self._envs = np.arange(num_envs)
+
+    def before_step(self, obs, mask, current):
+        """
+        Completes the pending transitions of the players that are about to act.
+        Returns (states, actions, rewards, next_states, next_masks, dones) or None if there are none.
+        """
+        envs = self._envs[self.pending[self._envs, current]]
+        if len(envs) == 0:
+            return None
+        players = current[envs]
+        self.pending[envs, players] = False
+        return (self.states[envs, players], self.actions[envs, players], self.rewards[envs, players], obs[envs],
+                mask[envs], np.zeros(len(envs), dtype=bool))
+
+    def after_step(self, obs, actions, rewards, dones, info):
+        """
+        Stores the transitions started by the last step.
+        obs are the observations the actions were selected on.
+        Returns the transitions ended by finished games in the same format as before_step, or None.
+        """
+        actor = info["actor"]
+        self.states[self._envs, actor] = obs
+        self.actions[self._envs, actor] = actions
+        self.rewards[self._envs, actor] = 0
+        self.pending[self._envs, actor] = True
+        self.rewards += rewards
+
+        envs, players = np.nonzero(self.pending & dones[:, None])
+        if len(envs) == 0:
+            return None
+        self.pending[envs] = False
+        next_states = np.zeros_like(self.states[envs, players])
+        next_masks = np.zeros((len(envs), CP.DIM_OUT), dtype=np.float32)
+        return (self.states[envs, players], self.actions[envs, players], self.rewards[envs, players], next_states,
+                next_masks, np.ones(len(envs), dtype=bool))